@@ -1,10 +1,12 @@
 import os
 
-import mysql.connector
+import sys
 
-import zipfile
+import argparse
+
+import importlib.util
 
-import sqlparse
+import zipfile
 
 import json
 
@@ -12,1630 +14,6608 @@ import re
 
 from dotenv import dotenv_values
 
-from openpyxl import Workbook
-
-import logging
+from types import MappingProxyType
 
-import pandas as pd
+import hashlib
 
-from backend.config import AUTHOR_PATH, SUBMISSION_PATH
+from contextlib import closing, contextmanager, nullcontext
 
 
  
 
-log_dir = 'logfile'
-
-os.makedirs(log_dir, exist_ok=True)
+import sqlite3
 
 
  
 
-logging.basicConfig(
-
-    filename=os.path.join(log_dir, 'execution.log'),
+import time
 
-    level=logging.INFO,
+import threading
 
-    format='%(asctime)s - %(levelname)s - %(message)s'
+import itertools
 
-)
+import logging
 
+import io
 
- 
+import queue
 
-def get_routine_type_and_name(sql):
 
-    """Extracts whether it's a procedure or function, and the name."""
+ 
 
-    match = re.search(r'CREATE\s+(PROCEDURE|FUNCTION)\s+`?(\w+)`?', sql, re.IGNORECASE)
+import csv
 
-    if match:
+from collections import OrderedDict
 
-        return match.group(1).upper(), match.group(2)
+def lazy_import(name):
 
-    return None, None
+    """
 
+    Returns a module that is only loaded on first attribute access (the
 
- 
+    importlib LazyLoader recipe), so commands that never touch a heavy
 
-def write_parameters_to_file(cursor, db_name, routine_name, output_file, is_author=False):
+    dependency such as the MySQL driver do not pay for it.
 
-    """Queries INFORMATION_SCHEMA.PARAMETERS and writes results to a file."""
+    """
 
-    query = f"""
+    if name in sys.modules:
 
-    SELECT PARAMETER_NAME, PARAMETER_MODE, DATA_TYPE, DTD_IDENTIFIER
+        return sys.modules[name]
 
-    FROM INFORMATION_SCHEMA.PARAMETERS
+    spec = importlib.util.find_spec(name)
 
-    WHERE SPECIFIC_SCHEMA = %s AND SPECIFIC_NAME = %s
+    if spec is None:
 
-    ORDER BY ORDINAL_POSITION;
+        raise ImportError(f"No module named {name!r}")
 
-    """
+    spec.loader = importlib.util.LazyLoader(spec.loader)
 
-    cursor.execute(query, (db_name, routine_name))
+    module = importlib.util.module_from_spec(spec)
 
-    rows = cursor.fetchall()
+    sys.modules[name] = module
 
-    param_list = []
+    spec.loader.exec_module(module)
 
+    parent, _, child = name.rpartition(".")
 
- 
+    if parent:
 
-    for row in rows:
+        setattr(sys.modules[parent], child, module)
 
-        param_name, param_mode, data_type, dtd_identifier = row
+    return module
 
-   
+ 
 
-        if param_name is None:
+# `mysql` is the bare namespace package; mysql.connector is only loaded on first use.
 
-            continue
+lazy_import("mysql.connector")
 
-       
+mysql = sys.modules["mysql"]
 
-        param_dict = {
+ 
 
-            "mode": param_mode or "IN",  
+# Author and submission folders come from the environment (or the CLI flags),
 
-            "name": param_name,
+# falling back to backend.config.
 
-            "type": dtd_identifier or data_type
+AUTHOR_PATH = os.environ.get("AUTHOR_PATH")
 
-        }
+SUBMISSION_PATH = os.environ.get("SUBMISSION_PATH")
 
-        param_list.append(param_dict)
+if AUTHOR_PATH is None or SUBMISSION_PATH is None:
 
-   
+    from backend import config as backend_config
 
-    if is_author:
+    AUTHOR_PATH = AUTHOR_PATH or backend_config.AUTHOR_PATH
 
-        with open(output_file, 'w') as f:
+    SUBMISSION_PATH = SUBMISSION_PATH or backend_config.SUBMISSION_PATH
 
-            f.write(f"{routine_name}\n")
 
-            if not param_list:
 
-                f.write("  (No parameters found)\n")
+ 
 
-            for param in param_list:
+log_dir = 'logfile'
 
-                f.write(f"{param['mode']} {param['name']} {param['type']}\n")
+os.makedirs(log_dir, exist_ok=True)
 
 
  
 
-    return param_list
-
+logging.basicConfig(
 
+    filename=os.path.join(log_dir, 'execution.log'),
 
- 
+    level=logging.INFO,
 
-def extract_parameters(row, max_params=10):
+    format='%(asctime)s - %(levelname)s - %(message)s'
 
-    params = []
+)
 
-    for i in range(1, max_params + 1):
 
-        mode = row.get(f'Param Mode {i}')
 
-        name = row.get(f'Param Name {i}')
 
-        dtype = row.get(f'Param Type {i}')
+ 
 
-        if pd.notna(mode) and pd.notna(dtype):
+# Connection settings; the MYSQL_* variables or the CLI flags override the defaults.
 
-            params.append({
+DB_CONFIG = {
 
-                "mode": mode,
+    "host": os.environ.get("MYSQL_HOST", "localhost"),
 
-                "name": name if pd.notna(name) else None,
+    "port": int(os.environ.get("MYSQL_PORT", "3306")),
 
-                "type": dtype
+    "user": os.environ.get("MYSQL_USER", "root"),
 
-            })
+    "password": os.environ.get("MYSQL_PASSWORD", "root"),
 
-    return params
+    "database": os.environ.get("MYSQL_DATABASE", "emp")
 
+}
 
 
  
 
-def write_to_json():
-
+# Number of trainees graded concurrently, each on its own pooled connection.
 
- 
+GRADING_WORKERS = int(os.environ.get("GRADING_WORKERS", "1"))
 
-    func_df = pd.read_excel(f"{AUTHOR_PATH}/Testcases/testcases.xlsx", sheet_name="function_tests")
 
-    proc_df = pd.read_excel(f"{AUTHOR_PATH}/Testcases/testcases.xlsx", sheet_name="procedure_tests")
 
 
  
 
-    fun_metadata = {
-
-        "routine_name": func_df.iloc[0]['Routine Name'],
+# The grading pipeline: DECODE_WORKERS threads hash, unzip and split submissions,
 
-        "routine_name_marks": int(func_df.iloc[0]['Routine Name Marks']),
+# GRADING_WORKERS threads execute them against MySQL, and one writer emits the
 
-        "routine_type": func_df.iloc[0]['Routine Type'],
+# results in submission order. PIPELINE_QUEUE_SIZE bounds the hand-off queues.
 
-        "routine_type_marks": int(func_df.iloc[0]['Routine Type Marks']),
+DECODE_WORKERS = int(os.environ.get("DECODE_WORKERS", "2"))
 
-        "parameters_marks": int(func_df.iloc[0]['Parameters Marks']),
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "8"))
 
-        "return_type": func_df.iloc[0].get('Return Type', None),
+ 
 
-        "return_type_marks": int(func_df.iloc[0].get('Return Type Marks', 0)),
+# Submission files are read straight out of each zip; set to 1 to also unpack
 
-        "parameters": extract_parameters(func_df.iloc[0])
+# them under SUBMISSION_PATH/unzipped_<trn_id> for debugging.
 
-    }
+EXTRACT_SUBMISSIONS = os.environ.get("EXTRACT_SUBMISSIONS", "0") == "1"
 
 
  
 
-    fun_tests = []
+# Graded submissions are cached by zip content hash plus test plan hash, so a
 
-    for _, row in func_df.iterrows():
+# re-run only grades new or changed zips. Set GRADING_CACHE=0 to regrade everything.
 
-        fun_tests.append({
+GRADING_CACHE_ENABLED = os.environ.get("GRADING_CACHE", "1") == "1"
 
-            "function_call": row['Function Call'],
+GRADING_CACHE_DIR = os.environ.get("GRADING_CACHE_DIR", os.path.join(log_dir, "grading_cache"))
 
-            "marks": int(row['Marks'])
 
-        })
+# Submission files are fingerprinted after SQL normalization; a file already graded
 
+# under the same test plan reuses that outcome. Set DEDUP_FILES=0 to run every file.
 
- 
+DEDUP_FILES = os.environ.get("DEDUP_FILES", "1") == "1"
 
-    fun_output = {
 
-        "meta_data": fun_metadata,
+ 
 
-        "tests": fun_tests
+# Time budgets in seconds: one statement, and everything graded for one trainee.
 
-    }
+# Statements over budget are killed and their test is recorded as failed.
 
+STATEMENT_TIMEOUT = float(os.environ.get("STATEMENT_TIMEOUT", "30"))
 
- 
+TRAINEE_TIMEOUT = float(os.environ.get("TRAINEE_TIMEOUT", "300"))
 
-    proc_metadata = {
 
-        "routine_name": proc_df.iloc[0]['Routine Name'],
+ 
 
-        "routine_name_marks": int(proc_df.iloc[0]['Routine Name Marks']),
+# Result sets are fetched FETCH_BATCH_SIZE rows at a time; one with more than
 
-        "routine_type": proc_df.iloc[0]['Routine Type'],
+# RESULT_ROW_LIMIT rows fails its test instead of exhausting memory.
 
-        "routine_type_marks": int(proc_df.iloc[0]['Routine Type Marks']),
+FETCH_BATCH_SIZE = int(os.environ.get("FETCH_BATCH_SIZE", "1000"))
 
-        "parameters_marks": int(proc_df.iloc[0]['Parameters Marks']),
+RESULT_ROW_LIMIT = int(os.environ.get("RESULT_ROW_LIMIT", "100000"))
 
-        "parameters": extract_parameters(proc_df.iloc[0])
+# Output lines kept to show in the log when a query file fails.
 
-    }
+RESULT_PREVIEW_ROWS = 50
 
 
  
 
-    proc_tests = []
+# Timing metrics for each run: a JSON summary, and a Prometheus text file that
 
-    for _, row in proc_df.iterrows():
+# node-exporter's textfile collector can pick up (point METRICS_PROM_PATH at its directory).
 
-        checks = []
+METRICS_JSON_PATH = os.environ.get("METRICS_JSON_PATH", os.path.join(log_dir, "metrics.json"))
 
-        for i in range(1, 10):
+METRICS_PROM_PATH = os.environ.get("METRICS_PROM_PATH", os.path.join(log_dir, "grader.prom"))
 
-            qcol = f'Check Query {i}'
+ 
 
-            mcol = f'Check Marks {i}'
+# Set TRACE_PATH to record nested timing spans of the run (trainees, phases,
 
-            if qcol in row and pd.notna(row[qcol]):
+# tests, statement execute and fetch) as a Chrome trace, viewable in Perfetto.
 
-                checks.append({
+TRACE_PATH = os.environ.get("TRACE_PATH", "")
 
-                    "query": row[qcol],
+ 
 
-                    "marks": int(row[mcol]) if pd.notna(row[mcol]) else 0
+# Function testcases are evaluated together in one SELECT per trainee when every
 
-                })
+# call is a plain scalar SELECT; set FUNCTION_BATCHING=0 to run them one by one.
 
-        proc_tests.append({
+FUNCTION_BATCHING = os.environ.get("FUNCTION_BATCHING", "1") == "1"
 
-            "procedure_call": row['Procedure Call'],
+ 
 
-            "marks": int(row['Marks']),
+# Testcase and check SQL is prepared once per connection and re-run with EXECUTE;
 
-            "checks": checks
+# set PREPARED_STATEMENTS=0 to send it as plain text every time.
 
-        })
+PREPARED_STATEMENTS = os.environ.get("PREPARED_STATEMENTS", "1") == "1"
 
 
- 
+# Rows of read-only trainee SELECTs are shared by data state and normalized SQL, for up
 
-    proc_output = {
+# to RESULT_CACHE_ENTRIES results of at most RESULT_CACHE_ROWS rows, holding no more than
 
-        "meta_data": proc_metadata,
+# RESULT_CACHE_BYTES of row text in all; 0 entries turns it off.
 
-        "tests": proc_tests
+RESULT_CACHE_ENTRIES = int(os.environ.get("RESULT_CACHE_ENTRIES", "2048"))
 
-    }
+RESULT_CACHE_ROWS = int(os.environ.get("RESULT_CACHE_ROWS", "10000"))
 
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_BYTES", str(64 * 1024 * 1024)))
 
  
 
-    with open(f"{AUTHOR_PATH}/Testcases/fun_testcases.json", "w") as f:
+# Every graded test outcome is recorded in this SQLite database.
 
-        json.dump(fun_output, f, indent=4)
+RESULTS_DB_PATH = os.environ.get("RESULTS_DB_PATH", os.path.join(log_dir, "results.db"))
 
 
  
 
-    with open(f"{AUTHOR_PATH}/Testcases/proc_testcases.json", "w") as f:
+# Author stages are skipped when their input files are unchanged since the last
 
-        json.dump(proc_output, f, indent=4)
+# run; set FORCE_AUTHOR_STAGES=1 to always rebuild them.
+
+FORCE_AUTHOR_STAGES = os.environ.get("FORCE_AUTHOR_STAGES", "0") == "1"
 
 
  
 
-    print("✅ Updated JSON files created successfully!")
+# Scoreboard rows are streamed to <SCOREBOARD_PATH>.xlsx/.csv/.parquet while grading.
+
+SCOREBOARD_PATH = os.environ.get("SCOREBOARD_PATH", "Trainees_marks")
 
+SCOREBOARD_FORMATS = os.environ.get("SCOREBOARD_FORMATS", "xlsx,csv,parquet").split(",")
+
+SCOREBOARD_PARQUET_BATCH = 1000
 
 
  
 
-def log_with_indent(log_file, text, indent_level=0):
+def get_routine_type_and_name(sql):
 
-   indent = '  ' * indent_level
+    """Extracts whether it's a procedure or function, and the name."""
 
-   for line in text.split('\n'):
+    match = re.search(r'CREATE\s+(PROCEDURE|FUNCTION)\s+`?(\w+)`?', sql, re.IGNORECASE)
 
-       log_file.write(f"{indent}{line}\n")
+    if match:
 
+        return match.group(1).upper(), match.group(2)
 
- 
+    return None, None
 
-def normalize_result(rows):
 
-    if not rows:
 
-        return None
 
-    return sorted([list(row) for row in rows])
+ 
+
+_DELIMITER_COMMAND = re.compile(r'\s*DELIMITER\s+(\S+)', re.IGNORECASE)
 
 
  
 
-def write_results_to_excel(Solutions_dir, output_file="Trainees_marks.xlsx"):
+_QUOTE_END = {
+
+    "'": re.compile(r"\\.|''|'", re.DOTALL),
 
-    result = compare_outputs()
+    '"': re.compile(r'\\.|""|"', re.DOTALL),
 
-    marks_dict = dict(dotenv_values(".env"))
+    "`": re.compile(r"``|`")
 
-    all_queries = set()
+}
 
-    for queries in result.values():
 
-        all_queries.update(queries.keys())
+ 
 
-    sorted_queries = sorted(list(all_queries))
+_statement_tokens = {}
 
-    wb = Workbook()
 
-    ws = wb.active
+ 
 
-    ws.title = "Trainee Results"
 
-    header = ["Trainee ID"] + [f"{query}_res" for query in sorted_queries]+["Fun_avg_marks"]
+ 
 
-    ws.append(header)
+def _statement_token_pattern(delimiter):
 
-    for trn_id in result.keys():
+    """Matches the next quote, comment start or delimiter outside of a quoted string."""
 
-        row = [trn_id]
+    if delimiter not in _statement_tokens:
 
-        for query in sorted_queries:
+        _statement_tokens[delimiter] = re.compile(
 
-            if result[trn_id][query]==1:
+            r"['\"`]|/\*!?|--(?=\s|$)|#|" + re.escape(delimiter)
 
-                result[trn_id][query] = marks_dict[query]
+        )
 
-            else:
+    return _statement_tokens[delimiter]
 
-                result[trn_id][query] = 0
 
-            row.append(result[trn_id][query])
+ 
 
 
  
 
-        fun_output_path = os.path.join(Solutions_dir, trn_id, "fun_output.json")
+_BLOCK_TOKEN = re.compile(r"[\w$]+|\S")
 
-        total_marks = 0
+ 
 
-        num_testcases = 0
+# After these a routine body starts a new statement, so IF, LOOP, WHILE and
 
+# REPEAT open a block there rather than call IF()/REPEAT() or qualify a DROP.
 
- 
+_STATEMENT_START = frozenset({";", ":", "BEGIN", "THEN", "ELSE", "DO", "LOOP", "REPEAT"})
 
-        if os.path.exists(fun_output_path):
+ 
 
-            with open(fun_output_path, 'r') as f:
+_ROUTINE_KINDS = frozenset({"FUNCTION", "PROCEDURE", "TRIGGER", "EVENT"})
 
-                fun_output = json.load(f)
+ 
 
-                for test_case in fun_output:
+_OTHER_CREATE = frozenset({
 
-                    num_testcases += 1
+    "TABLE", "VIEW", "INDEX", "DATABASE", "SCHEMA", "USER", "ROLE", "TEMPORARY",
 
-                    total_marks += int(test_case.get("marks", 0))
+    "UNIQUE", "FULLTEXT", "SPATIAL", "TABLESPACE", "SERVER", "LOGFILE", "RESOURCE"
 
-        else:
+})
 
-            logging.warning(f"{fun_output_path} not found for {trn_id}")
 
-            print(f"Warning: {fun_output_path} not found for {trn_id}")
+ 
 
 
  
 
-        avg_marks = round(total_marks / num_testcases, 2) if num_testcases > 0 else 0.0
+class _CompoundDepth:
 
-        row.append(avg_marks)
+    """
 
-       
+    Follows BEGIN ... END, CASE ... END and IF/LOOP/WHILE/REPEAT ... END <word>
 
-        ws.append(row)
+    nesting in a CREATE FUNCTION, PROCEDURE, TRIGGER or EVENT written without a
 
-    wb.save(output_file)
+    DELIMITER change, so the semicolons inside its body do not end it. Fed only
 
-    logging.info(f"Excel file '{output_file}' created with trainee results.")
+    the code outside quotes and comments; any other statement is dropped after
 
-    print(f"Excel file '{output_file}' created with trainee results.")
+    its first words.
+
+    """
 
 
  
 
-def generate_expected_output(cursor):
+    def __init__(self):
 
-    with open(f'{AUTHOR_PATH}/Testcases/fun_testcases.json', 'r') as f:
+        self.routine = None
 
-        json_data = json.load(f)
+        self.depth = 0
+
+        self.previous = None
 
 
  
 
-   
+    def feed(self, text):
 
-    meta_data = json_data.get("meta_data", {})
+        for token in _BLOCK_TOKEN.findall(text):
 
-    test_cases = json_data.get("tests", [])
+            word = token.upper()
 
+            if self.routine is None:
 
- 
+                if self.previous is None and word != "CREATE" or word in _OTHER_CREATE:
 
-    for case in test_cases:
+                    self.routine = False
 
-        call = case['function_call']
+                elif word in _ROUTINE_KINDS:
 
-        try:
+                    self.routine = True
 
-            cursor.execute(call)
+                self.previous = word
 
-            rows = cursor.fetchall()
+                continue
 
-            result = []
+            if not self.routine:
 
-            for row in rows:
+                return
 
-                result.append(str(row[0]))
+            if word == "BEGIN" or word == "CASE" and self.previous != "END":
 
-            case["Expected"] = str(result) if result else None
+                self.depth += 1
 
-        except Exception as e:
+            elif word in ("IF", "LOOP", "WHILE", "REPEAT") and self.previous in _STATEMENT_START:
 
-            case['Expected'] = f"Error: {e}"
+                self.depth += 1
 
-            print(e)
+            elif word == "END" and self.depth:
 
-            logging.error(f"Error generating expected output for function {call}: {e}")
+                self.depth -= 1
+
+            self.previous = word
 
 
  
 
-         
+    def inside(self):
 
-    updated_data = {
+        """Whether a delimiter here falls inside the body rather than ending the statement."""
 
-        "meta_data": meta_data,
+        if self.routine and self.depth:
 
-        "tests": test_cases
+            self.previous = ";"
 
-    }
+            return True
 
+        return False
 
- 
 
-    with open(f'{AUTHOR_PATH}/Testcases/fun_testcases.json', 'w') as f:
+ 
 
-       
 
-        json.dump(updated_data, f, indent = 4)
+ 
 
-   
+def split_sql_statements(source):
 
-    logging.info("Expected outputs added to fun_testcases.json")
+    """
 
-    print("Expected outputs added to fun_tesrcases.json")
+    Lazily yields the statements of a MySQL script given as a string, an
 
+    open file, or a tuple of statements already split by decode_submission.
 
+    Understands quoted strings and identifiers, --, # and /* */ comments and
 
+    client-side DELIMITER changes, so routine bodies written between
 
- 
+    DELIMITER $$ ... $$ come back as a single statement. Without a DELIMITER
 
-def generate_procedure_test(cursor):
+    change, BEGIN ... END nesting keeps a routine or trigger body together
 
+    (see _CompoundDepth). Comments before a statement are dropped; the
 
- 
+    delimiter itself is not included.
 
+    """
 
+    if isinstance(source, tuple):
 
-    with open(f'{AUTHOR_PATH}/Testcases/proc_testcases.json', 'r') as f:
+        yield from source
 
-        json_data = json.load(f)
+        return
 
 
  
 
-   
-
-    meta_data = json_data.get("meta_data", {})
-
-    test_cases = json_data.get("tests", [])
+    lines = source.splitlines(keepends=True) if isinstance(source, str) else source
 
 
  
 
-    for case in test_cases:
+    delimiter = ";"
 
-        try:
+    token = _statement_token_pattern(delimiter)
 
-            cursor.execute("START TRANSACTION")
+    buffer = []
 
-            cursor.execute(case["procedure_call"])
+    has_code = False
 
-            rows = cursor.fetchall()
+    quote = None
 
-            case["Expected"] = normalize_result(rows)
+    blocks = None
 
 
  
 
-            for check in case.get("checks", []):
+    for line in lines:
 
-                try:
+        if quote is None and not has_code:
 
-                    cursor.execute(check["query"])
+            command = _DELIMITER_COMMAND.match(line)
 
-                    rows = cursor.fetchall()
+            if command:
 
-                    check["Expected"] = normalize_result(rows)
+                delimiter = command.group(1)
 
-                except Exception as e:
+                token = _statement_token_pattern(delimiter)
 
-                    check["Expected"] = f"Error: {e}"
+                buffer = []
 
+                continue
 
- 
 
-            cursor.execute("ROLLBACK")
+ 
 
-        except Exception as e:
+        pos = 0
 
-            cursor.execute("ROLLBACK")
+        start = 0
 
-            case["Expected"] = f"Error: {e}"
+        end_of_line = len(line)
 
 
  
 
-    updated_data = {
+        while pos < end_of_line:
 
-        "meta_data": meta_data,
+            if quote == "*/":
 
-        "tests": test_cases
+                close = line.find("*/", pos)
 
-    }
+                if close < 0:
 
+                    break
 
- 
+                pos = close + 2
 
-    with open(f'{AUTHOR_PATH}/Testcases/proc_testcases.json', 'w') as f:
+                quote = None
 
-        json.dump(updated_data, f, indent=4)
+                continue
 
 
  
 
-    logging.info("Procedure test expected output generated.")
+            if quote is not None:
 
+                match = _QUOTE_END[quote].search(line, pos)
 
+                if not match:
 
+                    break
 
- 
+                pos = match.end()
+
+                if match.group() == quote:
 
-def run_trainee_procedures(cursor, mysql_path, trn_id):
+                    quote = None
 
-    import os, json, sqlparse
+                continue
 
 
  
 
-    proc_path = os.path.join(mysql_path, "proc.txt")
-
-    if not os.path.exists(proc_path):
+            match = token.search(line, pos)
 
-        return "execute successfully"
+            found = match.start() if match else end_of_line
 
 
  
 
-    output_lines = []
-
-    total_marks = 0
+            # The first real code of a statement discards any comments before it.
 
+            if not has_code and line[pos:found].strip():
 
- 
+                has_code = True
 
-    try:
+                buffer = []
 
-        with open(f'{AUTHOR_PATH}/Testcases/proc_testcases.json', 'r') as f:
+                start = pos
 
-            json_data = json.load(f)
+                blocks = _CompoundDepth() if delimiter == ";" else None
 
 
  
 
-        meta_data = json_data.get("meta_data", {})
+            if blocks is not None and has_code:
 
-        test_cases = json_data.get("tests", [])
+                blocks.feed(line[pos:found])
 
 
  
 
-        with open(proc_path, 'r') as f:
+            if not match:
 
-            content = f.read()
+                break
 
 
  
 
-        statements = sqlparse.split(content)
+            text = match.group()
 
-        for statement in statements:
+            pos = match.end()
 
-            if statement.strip():
 
-                cursor.execute(statement)
+ 
 
+            if text in _QUOTE_END or text == "/*!":
 
- 
+                if not has_code:
 
-        routine_type, routine_name = get_routine_type_and_name(content)
+                    has_code = True
 
-        cursor.execute("SELECT DATABASE();")
+                    buffer = []
 
-        db_name = cursor.fetchone()[0]
+                    start = found
 
-        params = write_parameters_to_file(cursor, db_name, routine_name, "param_output_file", is_author=False)
+                    blocks = _CompoundDepth() if delimiter == ";" else None
 
+                quote = "*/" if text == "/*!" else text
 
- 
+            elif text == "/*":
 
-        output_lines.append("\nMetadata Checks:")
+                quote = "*/"
 
+            elif text == "#" or text == "--":
 
- 
+                break
 
-        expected_routine_name = meta_data.get("routine_name")
+            elif blocks is not None and blocks.inside():
 
-        name_marks = meta_data.get("routine_name_marks", 0)
+                continue
 
-        if routine_name == expected_routine_name:
+            else:
 
-            output_lines.append("  Routine Name: Passed")
+                if has_code:
 
-            output_lines.append(f"  marks: {name_marks}")
+                    buffer.append(line[start:found])
 
-            total_marks += name_marks
+                    yield "".join(buffer).strip()
 
-        else:
+                buffer = []
 
-            output_lines.append("  Routine Name: Failed")
+                has_code = False
 
-            output_lines.append(f"    Expected: {expected_routine_name}")
+                start = pos
 
-            output_lines.append(f"    Actual:   {routine_name}")
+
+ 
+
+        buffer.append(line[start:])
 
 
  
 
-        expected_type = meta_data.get("routine_type")
+    if has_code:
 
-        type_marks = meta_data.get("routine_type_marks", 0)
+        statement = "".join(buffer).strip()
 
-        if routine_type.upper() == expected_type.upper():
+        if statement:
 
-            output_lines.append("  Routine Type: Passed")
+            yield statement
 
-            output_lines.append(f"  marks: {type_marks}")
 
-            total_marks += type_marks
+ 
 
-        else:
 
-            output_lines.append("  Routine Type: Failed")
+ 
 
-            output_lines.append(f"    Expected: {expected_type}")
+def benchmark_sql_splitter(path, repeat=3):
 
-            output_lines.append(f"    Actual:   {routine_type}")
+    """Times split_sql_statements against sqlparse.split on one SQL file."""
+
+    import sqlparse
 
 
  
 
-        expected_params = meta_data.get("parameters", [])
+    with open(path, 'r') as f:
 
-        param_marks = meta_data.get("parameters_marks", 0)
+        content = f.read()
 
 
  
 
-        def normalize_param(p):
+    timings = {}
 
-            return {
+    counts = {}
 
-                "mode": p["mode"].upper(),
+    for name, splitter in (("sqlparse", sqlparse.split), ("split_sql_statements", split_sql_statements)):
 
-                "name": p["name"].lower(),
+        best = None
 
-                "type": p["type"].lower()
+        for _ in range(repeat):
 
-            }
+            started = time.perf_counter()
 
+            statements = [s for s in splitter(content) if s.strip()]
 
- 
+            elapsed = time.perf_counter() - started
 
-        expected_normalized = [normalize_param(p) for p in expected_params]
+            best = elapsed if best is None else min(best, elapsed)
+
+        timings[name] = best
+
+        counts[name] = len(statements)
+
+
+ 
+
+    speedup = timings["sqlparse"] / timings["split_sql_statements"] if timings["split_sql_statements"] else 0.0
+
+    print(f"{path}: {len(content)} bytes")
+
+    for name in timings:
+
+        print(f"  {name}: {timings[name]:.4f}s, {counts[name]} statements")
+
+    print(f"  speedup: {speedup:.1f}x")
+
+    return timings
+
+
+ 
+
+_routine_metadata = threading.local()
+
+ 
+
+def load_routine_metadata(cursor):
+
+    """
+
+    Name, type, parameters and return type of every routine in the current
+
+    schema, from one INFORMATION_SCHEMA query. Returns a dict keyed by
+
+    (routine type, lower-cased name), since a function and a procedure may
+
+    share a name. The result is cached for the calling thread until a
+
+    statement changes the schema (see invalidate_routine_metadata).
+
+    """
+
+    cached = getattr(_routine_metadata, "routines", None)
+
+    if cached is not None:
+
+        return cached
+
+    cursor.execute("""
+
+        SELECT r.ROUTINE_NAME, r.ROUTINE_TYPE, r.DTD_IDENTIFIER,
+
+               p.PARAMETER_NAME, p.PARAMETER_MODE, p.DATA_TYPE, p.DTD_IDENTIFIER
+
+        FROM INFORMATION_SCHEMA.ROUTINES r
+
+        LEFT JOIN INFORMATION_SCHEMA.PARAMETERS p
+
+            ON p.SPECIFIC_SCHEMA = r.ROUTINE_SCHEMA
+
+            AND p.SPECIFIC_NAME = r.ROUTINE_NAME
+
+            AND p.ROUTINE_TYPE = r.ROUTINE_TYPE
+
+        WHERE r.ROUTINE_SCHEMA = DATABASE()
+
+        ORDER BY r.ROUTINE_NAME, r.ROUTINE_TYPE, p.ORDINAL_POSITION
+
+    """)
+
+    routines = {}
+
+    for name, routine_type, return_type, param_name, param_mode, data_type, dtd_identifier in cursor.fetchall():
+
+        routine = routines.setdefault((routine_type, name.lower()), {
+
+            "name": name,
+
+            "type": routine_type,
+
+            "return_type": return_type,
+
+            "parameters": []
+
+        })
+
+        # A function's return value is listed as an unnamed parameter; skip it.
+
+        if param_name is None:
+
+            continue
+
+        routine["parameters"].append({
+
+            "mode": param_mode or "IN",
+
+            "name": param_name,
+
+            "type": dtd_identifier or data_type
+
+        })
+
+    _routine_metadata.routines = routines
+
+    return routines
+
+ 
+
+def invalidate_routine_metadata(statement=None):
+
+    """Drops the cached routine metadata, or only when the given statement can change routines."""
+
+    if statement is None or re.match(r"\s*(CREATE|DROP|ALTER)\b", statement, re.IGNORECASE):
+
+        _routine_metadata.routines = None
+
+ 
+
+def normalize_sql_type(sql_type):
+
+    """Lower-cased type without whitespace, so DECIMAL(10, 2) and decimal(10,2) compare equal."""
+
+    return re.sub(r"\s+", "", sql_type or "").lower()
+
+ 
+
+def write_parameters_to_file(routine_name, params, output_file):
+
+    """Writes a routine's parameters, as listed by load_routine_metadata, to a file."""
+
+    with open(output_file, 'w') as f:
+
+        f.write(f"{routine_name}\n")
+
+        if not params:
+
+            f.write("  (No parameters found)\n")
+
+        for param in params:
+
+            f.write(f"{param['mode']} {param['name']} {param['type']}\n")
+
+ 
+
+
+ 
+
+def read_testcase_sheets(path, sheet_names):
+
+    """
+
+    Reads the given sheets of a workbook opened once in read-only (streaming)
+
+    mode. Each sheet comes back as (columns, rows): columns maps every header
+
+    to its position, rows are the non-blank rows as tuples of cell values,
+
+    with None for empty cells.
+
+    """
+
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+
+    try:
+
+        sheets = {}
+
+        for sheet_name in sheet_names:
+
+            rows = workbook[sheet_name].iter_rows(values_only=True)
+
+            header = next(rows, ())
+
+            columns = {str(name).strip(): idx for idx, name in enumerate(header) if name is not None}
+
+            sheets[sheet_name] = (columns, [row for row in rows if any(value is not None for value in row)])
+
+        return sheets
+
+    finally:
+
+        workbook.close()
+
+ 
+
+
+ 
+
+def cell_value(row, columns, name, default=None):
+
+    """The value under a header, or default when the column is missing or the cell is empty."""
+
+    idx = columns.get(name)
+
+    if idx is None or idx >= len(row) or row[idx] is None:
+
+        return default
+
+    return row[idx]
+
+ 
+
+
+ 
+
+def numbered_columns(columns, prefix):
+
+    """The n of every '<prefix> n' header, in order, however many the sheet has."""
+
+    pattern = re.compile(rf"{re.escape(prefix)} (\d+)$")
+
+    return sorted(int(match.group(1)) for match in map(pattern.match, columns) if match)
+
+ 
+
+
+ 
+
+def extract_parameters(row, columns):
+
+    params = []
+
+    for i in numbered_columns(columns, "Param Mode"):
+
+        mode = cell_value(row, columns, f'Param Mode {i}')
+
+        dtype = cell_value(row, columns, f'Param Type {i}')
+
+        if mode is not None and dtype is not None:
+
+            params.append({
+
+                "mode": mode,
+
+                "name": cell_value(row, columns, f'Param Name {i}'),
+
+                "type": dtype
+
+            })
+
+    return params
+
+ 
+
+
+ 
+
+def write_to_json():
+
+    sheets = read_testcase_sheets(f"{AUTHOR_PATH}/Testcases/testcases.xlsx", ["function_tests", "procedure_tests"])
+
+    func_columns, func_rows = sheets["function_tests"]
+
+    proc_columns, proc_rows = sheets["procedure_tests"]
+
+ 
+
+    # Routine metadata is read from the first row of each sheet.
+
+    func_first = func_rows[0]
+
+    fun_metadata = {
+
+        "routine_name": cell_value(func_first, func_columns, 'Routine Name'),
+
+        "routine_name_marks": int(cell_value(func_first, func_columns, 'Routine Name Marks', 0)),
+
+        "routine_type": cell_value(func_first, func_columns, 'Routine Type'),
+
+        "routine_type_marks": int(cell_value(func_first, func_columns, 'Routine Type Marks', 0)),
+
+        "parameters_marks": int(cell_value(func_first, func_columns, 'Parameters Marks', 0)),
+
+        "return_type": cell_value(func_first, func_columns, 'Return Type'),
+
+        "return_type_marks": int(cell_value(func_first, func_columns, 'Return Type Marks', 0)),
+
+        "parameters": extract_parameters(func_first, func_columns)
+
+    }
+
+ 
+
+    call_idx = func_columns['Function Call']
+
+    marks_idx = func_columns['Marks']
+
+    fun_tests = [
+
+        {"function_call": row[call_idx], "marks": int(row[marks_idx])}
+
+        for row in func_rows
+
+    ]
+
+    fun_output = {
+
+        "meta_data": fun_metadata,
+
+        "tests": fun_tests
+
+    }
+
+ 
+
+    proc_first = proc_rows[0]
+
+    proc_metadata = {
+
+        "routine_name": cell_value(proc_first, proc_columns, 'Routine Name'),
+
+        "routine_name_marks": int(cell_value(proc_first, proc_columns, 'Routine Name Marks', 0)),
+
+        "routine_type": cell_value(proc_first, proc_columns, 'Routine Type'),
+
+        "routine_type_marks": int(cell_value(proc_first, proc_columns, 'Routine Type Marks', 0)),
+
+        "parameters_marks": int(cell_value(proc_first, proc_columns, 'Parameters Marks', 0)),
+
+        "parameters": extract_parameters(proc_first, proc_columns)
+
+    }
+
+ 
+
+    # Check columns are resolved once, for however many the sheet defines.
+
+    check_columns = [
+
+        (proc_columns[f'Check Query {i}'], proc_columns.get(f'Check Marks {i}'))
+
+        for i in numbered_columns(proc_columns, "Check Query")
+
+    ]
+
+    call_idx = proc_columns['Procedure Call']
+
+    marks_idx = proc_columns['Marks']
+
+    proc_tests = []
+
+    for row in proc_rows:
+
+        checks = []
+
+        for query_idx, check_marks_idx in check_columns:
+
+            query = row[query_idx] if query_idx < len(row) else None
+
+            if query is not None:
+
+                check_marks = row[check_marks_idx] if check_marks_idx is not None and check_marks_idx < len(row) else None
+
+                checks.append({
+
+                    "query": query,
+
+                    "marks": int(check_marks) if check_marks is not None else 0
+
+                })
+
+        proc_tests.append({
+
+            "procedure_call": row[call_idx],
+
+            "marks": int(row[marks_idx]),
+
+            "checks": checks
+
+        })
+
+    proc_output = {
+
+        "meta_data": proc_metadata,
+
+        "tests": proc_tests
+
+    }
+
+ 
+
+    with open(f"{AUTHOR_PATH}/Testcases/fun_testcases.json", "w") as f:
+
+        json.dump(fun_output, f, indent=4)
+
+    with open(f"{AUTHOR_PATH}/Testcases/proc_testcases.json", "w") as f:
+
+        json.dump(proc_output, f, indent=4)
+
+    print("✅ Updated JSON files created successfully!")
+
+ 
+
+
+ 
+
+def log_with_indent(log_file, text, indent_level=0):
+
+   indent = '  ' * indent_level
+
+   for line in text.split('\n'):
+
+       log_file.write(f"{indent}{line}\n")
+
+
+ 
+
+def result_fingerprint(rows, expected_count=None):
+
+    """
+
+    Order-independent fingerprint of a result set: the row count plus the sum
+
+    (mod 2**64) of a 64-bit hash of every row. Equal multisets of rows give
+
+    equal fingerprints in linear time, without sorting or copying the rows.
+
+    The first RESULT_PREVIEW_ROWS rows are kept as a preview for the log.
+
+    With expected_count, reading stops at the first row past it, since the
+
+    result can no longer match; the fingerprint is then marked exceeded.
+
+    """
+
+    total = 0
+
+    count = 0
+
+    preview = []
+
+    # Rows may be any iterable, so a streamed result set is never held in memory.
+
+    for row in rows:
+
+        count += 1
+
+        if len(preview) < RESULT_PREVIEW_ROWS:
+
+            preview.append(str(tuple(row)))
+
+        if expected_count is not None and count > expected_count:
+
+            # stream_rows discards the unread rest once it is closed.
+
+            close = getattr(rows, "close", None)
+
+            if close is not None:
+
+                close()
+
+            return {"row_count": count, "fingerprint": None, "exceeded": True, "preview": preview}
+
+        row_hash = hashlib.blake2b(repr(tuple(row)).encode("utf-8"), digest_size=8).digest()
+
+        total = (total + int.from_bytes(row_hash, "big")) & 0xFFFFFFFFFFFFFFFF
+
+    if not count:
+
+        return None
+
+    return {"row_count": count, "fingerprint": f"{total:016x}", "preview": preview}
+
+ 
+
+
+ 
+
+def fingerprint_matches(fingerprint, expected):
+
+    """Compares a fingerprint computed while streaming a result set with a stored one."""
+
+    if fingerprint is None or expected is None:
+
+        return fingerprint is None and expected is None
+
+    if isinstance(expected, str) or fingerprint.get("exceeded"):
+
+        return False
+
+    return (fingerprint["row_count"], fingerprint["fingerprint"]) == (expected["row_count"], expected["fingerprint"])
+
+ 
+
+
+ 
+
+def describe_fingerprint(fingerprint):
+
+    """Human-readable form of a result fingerprint for the log, with its preview rows when kept."""
+
+    if fingerprint is None:
+
+        return "no rows"
+
+    if isinstance(fingerprint, str):
+
+        return fingerprint
+
+    if fingerprint.get("exceeded"):
+
+        text = f"at least {fingerprint['row_count']} rows"
+
+    else:
+
+        text = f"{fingerprint['row_count']} rows (fingerprint {fingerprint['fingerprint']})"
+
+    preview = fingerprint.get("preview")
+
+    if preview is None:
+
+        return text
+
+    return f"{text}: {describe_preview(list(preview), fingerprint['row_count'])}"
+
+ 
+
+
+ 
+
+def expected_row_count(expected):
+
+    """Row count of a stored result fingerprint; 0 for no rows or an error."""
+
+    if expected is None or isinstance(expected, str):
+
+        return 0
+
+    return expected["row_count"]
+
+
+ 
+
+
+ 
+
+def trainee_row_limit(expected_count):
+
+    """
+
+    Row cap for a trainee result expected to have expected_count rows:
+
+    RESULT_ROW_LIMIT, raised to one past the expected count so a correct
+
+    answer is never cut short and a longer one still shows as longer.
+
+    """
+
+    if not RESULT_ROW_LIMIT:
+
+        return 0
+
+    return max(RESULT_ROW_LIMIT, expected_count + 1)
+
+
+ 
+
+def latency_summary(values):
+
+    """Count, sum, p50, p95 and max (nearest rank) of a list of durations in seconds."""
+
+    if not values:
+
+        return {"count": 0, "sum": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+
+    ordered = sorted(values)
+
+    def percentile(q):
+
+        return ordered[max(0, -(-len(ordered) * q // 100) - 1)]
+
+    return {
+
+        "count": len(ordered),
+
+        "sum": round(sum(ordered), 6),
+
+        "p50": round(percentile(50), 6),
+
+        "p95": round(percentile(95), 6),
+
+        "max": round(ordered[-1], 6)
+
+    }
+
+ 
+
+
+ 
+
+class GradingMetrics:
+
+    """
+
+    Thread-safe timers and counters for one run: seconds per phase (overall
+
+    and per trainee), per-statement latencies, round trips, rows and bytes
+
+    fetched. write_report() exports them as JSON and Prometheus text.
+
+    """
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+
+        self.started = time.time()
+
+        self.phases = {}
+
+        self.trainees = {}
+
+        self.statements = []
+
+        self.counters = {}
+
+ 
+
+    def record_phase(self, phase, started, trn_id=None):
+
+        """Adds the time since started (a perf_counter value) to a phase."""
+
+        elapsed = time.perf_counter() - started
+
+        TRACER.record(phase, started, "phase", trainee=trn_id)
+
+        with self._lock:
+
+            self.phases.setdefault(phase, []).append(elapsed)
+
+            if trn_id is not None:
+
+                phases = self.trainees.setdefault(trn_id, {})
+
+                phases[phase] = phases.get(phase, 0.0) + elapsed
+
+        return elapsed
+
+ 
+
+    def record_statement(self, started):
+
+        with self._lock:
+
+            self.statements.append(time.perf_counter() - started)
+
+            self.counters["statements"] = self.counters.get("statements", 0) + 1
+
+            self.counters["round_trips"] = self.counters.get("round_trips", 0) + 1
+
+ 
+
+    def count(self, name, amount=1):
+
+        with self._lock:
+
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+ 
+
+    def summary(self):
+
+        with self._lock:
+
+            hits = self.counters.get("statement_cache_hits", 0)
+
+            misses = self.counters.get("statement_cache_misses", 0)
+
+            files = self.counters.get("files_graded", 0)
+
+            deduplicated = self.counters.get("files_deduplicated", 0)
+
+            result_hits = self.counters.get("result_cache_hits", 0)
+
+            result_misses = self.counters.get("result_cache_misses", 0)
+
+            return {
+
+                "started_at": self.started,
+
+                "duration_seconds": round(time.time() - self.started, 3),
+
+                "counters": dict(self.counters),
+
+                "statement_cache_hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+
+                "dedup_ratio": round(deduplicated / files, 4) if files else None,
+
+                "result_cache_hit_rate": round(result_hits / (result_hits + result_misses), 4) if result_hits + result_misses else None,
+
+                "phases": {phase: latency_summary(values) for phase, values in self.phases.items()},
+
+                "statements": latency_summary(self.statements),
+
+                "trainees": {
+
+                    trn_id: {phase: round(seconds, 6) for phase, seconds in phases.items()}
+
+                    for trn_id, phases in self.trainees.items()
+
+                }
+
+            }
+
+ 
+
+    def prometheus_text(self, summary=None):
+
+        """The summary in the Prometheus text exposition format."""
+
+        summary = summary or self.summary()
+
+        lines = [
+
+            "# HELP grader_phase_seconds Seconds spent per grading phase.",
+
+            "# TYPE grader_phase_seconds summary"
+
+        ]
+
+        for phase, stats in sorted(summary["phases"].items()):
+
+            lines.append(f'grader_phase_seconds{{phase="{phase}",quantile="0.5"}} {stats["p50"]}')
+
+            lines.append(f'grader_phase_seconds{{phase="{phase}",quantile="0.95"}} {stats["p95"]}')
+
+            lines.append(f'grader_phase_seconds_sum{{phase="{phase}"}} {stats["sum"]}')
+
+            lines.append(f'grader_phase_seconds_count{{phase="{phase}"}} {stats["count"]}')
+
+        lines += [
+
+            "# HELP grader_phase_max_seconds Slowest single occurrence of each grading phase.",
+
+            "# TYPE grader_phase_max_seconds gauge"
+
+        ]
+
+        for phase, stats in sorted(summary["phases"].items()):
+
+            lines.append(f'grader_phase_max_seconds{{phase="{phase}"}} {stats["max"]}')
+
+        statements = summary["statements"]
+
+        lines += [
+
+            "# HELP grader_statement_seconds Latency of trainee statements, including fetching their rows.",
+
+            "# TYPE grader_statement_seconds summary",
+
+            f'grader_statement_seconds{{quantile="0.5"}} {statements["p50"]}',
+
+            f'grader_statement_seconds{{quantile="0.95"}} {statements["p95"]}',
+
+            f"grader_statement_seconds_sum {statements['sum']}",
+
+            f"grader_statement_seconds_count {statements['count']}",
+
+            "# HELP grader_statement_max_seconds Slowest trainee statement.",
+
+            "# TYPE grader_statement_max_seconds gauge",
+
+            f"grader_statement_max_seconds {statements['max']}"
+
+        ]
+
+        for name, value in sorted(summary["counters"].items()):
+
+            lines.append(f"# TYPE grader_{name}_total counter")
+
+            lines.append(f"grader_{name}_total {value}")
+
+        if summary["statement_cache_hit_rate"] is not None:
+
+            lines += [
+
+                "# HELP grader_statement_cache_hit_ratio Share of test statements run from the prepared-statement cache.",
+
+                "# TYPE grader_statement_cache_hit_ratio gauge",
+
+                f"grader_statement_cache_hit_ratio {summary['statement_cache_hit_rate']}"
+
+            ]
+
+        if summary["dedup_ratio"] is not None:
+
+            lines += [
+
+                "# HELP grader_file_dedup_ratio Share of submission files graded from an earlier identical file.",
+
+                "# TYPE grader_file_dedup_ratio gauge",
+
+                f"grader_file_dedup_ratio {summary['dedup_ratio']}"
+
+            ]
+
+        if summary["result_cache_hit_rate"] is not None:
+
+            lines += [
+
+                "# HELP grader_result_cache_hit_ratio Share of read-only SELECTs answered from the result cache.",
+
+                "# TYPE grader_result_cache_hit_ratio gauge",
+
+                f"grader_result_cache_hit_ratio {summary['result_cache_hit_rate']}"
+
+            ]
+
+        lines += [
+
+            "# TYPE grader_run_duration_seconds gauge",
+
+            f"grader_run_duration_seconds {summary['duration_seconds']}",
+
+            "# TYPE grader_last_run_timestamp_seconds gauge",
+
+            f"grader_last_run_timestamp_seconds {round(summary['started_at'], 3)}"
+
+        ]
+
+        return "\n".join(lines) + "\n"
+
+ 
+
+    def write_report(self, json_path=None, prometheus_path=None):
+
+        """Writes both reports; each replaces the old file atomically so collectors never read half of one."""
+
+        summary = self.summary()
+
+        reports = (
+
+            (json_path or METRICS_JSON_PATH, json.dumps(summary, indent=2)),
+
+            (prometheus_path or METRICS_PROM_PATH, self.prometheus_text(summary))
+
+        )
+
+        for path, text in reports:
+
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+            tmp_path = f"{path}.tmp"
+
+            with open(tmp_path, 'w') as f:
+
+                f.write(text)
+
+            os.replace(tmp_path, path)
+
+        logging.info(f"Metrics written to {reports[0][0]} and {reports[1][0]}")
+
+ 
+
+
+ 
+
+METRICS = GradingMetrics()
+
+
+ 
+
+
+ 
+
+class SpanTracer:
+
+    """
+
+    Records complete ("X") events in the Chrome trace event format, one track
+
+    per thread, so parallel workers show their stragglers, idle gaps and
+
+    waits for a free connection on one timeline. Spans nest by time range.
+
+    Does nothing unless a trace path is set.
+
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+
+        self.enabled = bool(path)
+
+        self._origin = time.perf_counter()
+
+        self._events = []
+
+        self._threads = set()
+
+        self._lock = threading.Lock()
+
+ 
+
+    def record(self, name, started, category="grading", **args):
+
+        """Adds a span from started (a perf_counter value) until now."""
+
+        if not self.enabled:
+
+            return
+
+        now = time.perf_counter()
+
+        thread = threading.current_thread()
+
+        event = {
+
+            "name": name,
+
+            "cat": category,
+
+            "ph": "X",
+
+            "ts": round((started - self._origin) * 1e6, 1),
+
+            "dur": round((now - started) * 1e6, 1),
+
+            "pid": os.getpid(),
+
+            "tid": thread.ident,
+
+            "args": {key: value for key, value in args.items() if value is not None}
+
+        }
+
+        with self._lock:
+
+            if thread.ident not in self._threads:
+
+                self._threads.add(thread.ident)
+
+                self._events.append({
+
+                    "name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread.ident,
+
+                    "args": {"name": thread.name}
+
+                })
+
+            self._events.append(event)
+
+ 
+
+    def write(self):
+
+        if not self.enabled:
+
+            return
+
+        with self._lock:
+
+            trace = {"traceEvents": list(self._events), "displayTimeUnit": "ms"}
+
+        tmp_path = f"{self.path}.tmp"
+
+        with open(tmp_path, 'w') as f:
+
+            json.dump(trace, f)
+
+        os.replace(tmp_path, self.path)
+
+        logging.info(f"Trace with {len(trace['traceEvents'])} events written to {self.path}")
+
+ 
+
+
+ 
+
+TRACER = SpanTracer(TRACE_PATH)
+
+
+ 
+
+
+ 
+
+class StatementTimeout(Exception):
+
+    """Raised when a trainee statement overruns its time budget."""
+
+
+
+ 
+
+class StatementRejected(Exception):
+
+    """Raised for trainee SQL that would leave the worker schema."""
+
+
+
+ 
+
+# Statements that switch or replace the current database; graded SQL must stay in its schema.
+
+_SCHEMA_SWITCH = re.compile(r'(USE|(CREATE|DROP)\s+(DATABASE|SCHEMA))\b', re.IGNORECASE)
+
+
+ 
+
+# USE of a single database, the only form a graded file may keep (as a no-op).
+
+_USE_SCHEMA = re.compile(r"USE\s+(`?)([\w$]+)\1\s*;?\s*$", re.IGNORECASE)
+
+
+ 
+
+# Keywords after which database.name can only be a table or routine, never alias.column.
+
+_OBJECT_POSITION = re.compile(
+
+    r"(?<![\w$])(INTO|UPDATE|TABLE|TABLES|TRUNCATE|FROM|JOIN|VIEW|FUNCTION|PROCEDURE|TRIGGER|CALL|EXISTS)\s*$",
+
+    re.IGNORECASE
+
+)
+
+
+ 
+
+_qualifier_patterns = {}
+
+
+ 
+
+
+ 
+
+def _qualifier_pattern(database):
+
+    """
+
+    Two patterns: one matching a string literal, or database as the qualifier
+
+    of a following name; one finding database used as a table alias.
+
+    """
+
+    if database not in _qualifier_patterns:
+
+        name = re.escape(database)
+
+        _qualifier_patterns[database] = (
+
+            re.compile(
+
+                r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\""
+
+                rf"|(?<![\w$.`])(?:`{name}`|{name}(?![\w$]))(?=\s*\.\s*(`(?:[^`]|``)+`|[\w$]+)(\s*\()?)",
+
+                re.IGNORECASE
+
+            ),
+
+            re.compile(rf"[\w$`]\s+(AS\s+)?(`{name}`|{name}(?![\w$]))(?!\s*\.)", re.IGNORECASE)
+
+        )
+
+    return _qualifier_patterns[database]
+
+
+ 
+
+
+ 
+
+def confine_statement(statement, schema, names=frozenset()):
+
+    """
+
+    Keeps one graded statement inside schema. USE of the author database or
+
+    of schema itself returns None (nothing to run), any other USE and
+
+    CREATE/DROP DATABASE raise StatementRejected, and objects qualified with
+
+    the author database are moved into schema. Since alias.column looks the
+
+    same, database.name is only rewritten in a table position, as a call, or
+
+    when name is one of names (the fixture's tables, views and routines) and
+
+    the statement does not use the database name as an alias.
+
+    """
+
+    head = statement.lstrip()
+
+    database = DB_CONFIG["database"]
+
+    use = _USE_SCHEMA.match(head)
+
+    if use:
+
+        if use.group(2).lower() in (database.lower(), schema.lower()):
+
+            return None
+
+        raise StatementRejected(f"USE {use.group(2)} is not allowed in graded SQL")
+
+    if _SCHEMA_SWITCH.match(head):
+
+        raise StatementRejected("CREATE/DROP DATABASE is not allowed in graded SQL")
+
+    if database.lower() == schema.lower() or database.lower() not in statement.lower():
+
+        return statement
+
+    qualifier, alias = _qualifier_pattern(database)
+
+    if alias.search(statement):
+
+        names = frozenset()
+
+
+ 
+
+    def qualify(match):
+
+        if match.group(1) is None:
+
+            return match.group()
+
+        name = match.group(1).strip("`").replace("``", "`").lower()
+
+        start = match.start()
+
+        if name in names or match.group(2) or _OBJECT_POSITION.search(statement[max(0, start - 40):start]):
+
+            return f"`{schema}`"
+
+        return match.group()
+
+
+ 
+
+    return qualifier.sub(qualify, statement)
+
+
+ 
+
+_schema_confinement = threading.local()
+
+
+ 
+
+@contextmanager
+
+def confined_to_schema(cursor, schema):
+
+    """Applies confine_statement to every execute_statement call made on this thread."""
+
+    names = frozenset()
+
+    if schema != DB_CONFIG["database"]:
+
+        definitions = fixture_definitions(cursor)
+
+        names = frozenset(name.lower() for kind in ("tables", "views", "routines") for name, _ in definitions[kind])
+
+    previous = getattr(_schema_confinement, "state", None)
+
+    _schema_confinement.state = (schema, names)
+
+    try:
+
+        yield
+
+    finally:
+
+        _schema_confinement.state = previous
+
+
+ 
+
+# MySQL errors raised when max_execution_time stops a SELECT or KILL QUERY interrupts a statement.
+
+QUERY_TIMEOUT_ERRNOS = (3024, 1317)
+
+
+ 
+
+class QueryWatchdog:
+
+    """
+
+    Kills statements that overrun their deadline. A single daemon thread
+
+    watches every grading connection and issues KILL QUERY on a connection
+
+    of its own, so a CALL stuck in a loop cannot block its worker forever.
+
+    """
+
+    def __init__(self):
+
+        self._deadlines = {}
+
+        self._condition = threading.Condition()
+
+        self._thread = None
+
+        self._connection = None
+
+
+ 
+
+    @contextmanager
+
+    def watch(self, connection_id, timeout):
+
+        watch = {
+
+            "connection_id": connection_id, "deadline": time.monotonic() + timeout,
+
+            "killed": False, "killing": False, "active": True
+
+        }
+
+        with self._condition:
+
+            if self._thread is None:
+
+                self._thread = threading.Thread(target=self._run, name="query-watchdog", daemon=True)
+
+                self._thread.start()
+
+            self._deadlines[id(watch)] = watch
+
+            self._condition.notify()
+
+        try:
+
+            yield watch
+
+        finally:
+
+            with self._condition:
+
+                watch["active"] = False
+
+                # The connection's next statement must not start before a pending kill is sent.
+
+                while watch["killing"]:
+
+                    self._condition.wait()
+
+                self._deadlines.pop(id(watch), None)
+
+
+ 
+
+    def _run(self):
+
+        while True:
+
+            with self._condition:
+
+                now = time.monotonic()
+
+                pending = [watch for watch in self._deadlines.values() if not watch["killed"]]
+
+                expired = [watch for watch in pending if watch["deadline"] <= now]
+
+                if not expired:
+
+                    deadlines = [watch["deadline"] for watch in pending]
+
+                    self._condition.wait(min(deadlines) - now if deadlines else None)
+
+                    continue
+
+                for watch in expired:
+
+                    watch["killed"] = True
+
+                    watch["killing"] = True
+
+
+ 
+
+            # KILL QUERY, and a reconnect if needed, run without the lock so other
+
+            # workers' statements come and go meanwhile. An expired watch stays open
+
+            # until its kill is sent, so the kill cannot hit the next statement.
+
+            for watch in expired:
+
+                with self._condition:
+
+                    active = watch["active"]
+
+                if active:
+
+                    self._kill(watch["connection_id"])
+
+
+ 
+
+            with self._condition:
+
+                for watch in expired:
+
+                    watch["killing"] = False
+
+                self._condition.notify_all()
+
+
+ 
+
+    def _kill(self, connection_id):
+
+        try:
+
+            if self._connection is None or not self._connection.is_connected():
+
+                self._connection = mysql.connector.connect(**DB_CONFIG)
+
+            killer = self._connection.cursor()
+
+            killer.execute(f"KILL QUERY {int(connection_id)}")
+
+            killer.close()
+
+            logging.warning(f"Killed runaway query on connection {connection_id}")
+
+        except mysql.connector.Error as e:
+
+            logging.error(f"Could not kill query on connection {connection_id}: {e}")
+
+
+ 
+
+QUERY_WATCHDOG = QueryWatchdog()
+
+_grading_budget = threading.local()
+
+
+ 
+
+@contextmanager
+
+def grading_budget(cursor, timeout=None):
+
+    """
+
+    Applies the time budgets to every execute_statement call made on this
+
+    thread. SELECTs are also capped server-side with max_execution_time.
+
+    """
+
+    timeout = TRAINEE_TIMEOUT if timeout is None else timeout
+
+    cursor.execute("SELECT CONNECTION_ID(), @@SESSION.max_execution_time")
+
+    connection_id, previous_limit = cursor.fetchone()
+
+    cursor.execute(f"SET SESSION max_execution_time = {int(STATEMENT_TIMEOUT * 1000)}")
+
+    _grading_budget.state = (connection_id, time.monotonic() + timeout)
+
+    try:
+
+        yield
+
+    finally:
+
+        _grading_budget.state = None
+
+        try:
+
+            cursor.execute(f"SET SESSION max_execution_time = {int(previous_limit)}")
+
+        except mysql.connector.Error as e:
+
+            logging.error(f"Could not restore max_execution_time: {e}")
+
+
+ 
+
+class ResultTooLarge(Exception):
+
+    """Raised when a result set has more rows than RESULT_ROW_LIMIT."""
+
+
+ 
+
+def stream_rows(cursor, limit=None, batch_size=None):
+
+    """
+
+    Yields the current result set in fetchmany batches. Past the row limit the
+
+    rest of the result is read and discarded, then ResultTooLarge is raised;
+
+    a limit of 0 means no cap. A consumer that stops early closes the
+
+    generator, which discards the unread rest the same way.
+
+    """
+
+    limit = RESULT_ROW_LIMIT if limit is None else limit
+
+    batch_size = FETCH_BATCH_SIZE if batch_size is None else batch_size
+
+    count = 0
+
+    while True:
+
+        batch = cursor.fetchmany(batch_size)
+
+        if not batch:
+
+            return
+
+        count += len(batch)
+
+        METRICS.count("round_trips")
+
+        METRICS.count("rows_fetched", len(batch))
+
+        # Bytes are approximated by the text length of the fetched values.
+
+        METRICS.count("bytes_fetched", sum(len(str(value)) for row in batch for value in row))
+
+        if limit and count > limit:
+
+            while cursor.fetchmany(batch_size):
+
+                pass
+
+            METRICS.count("results_too_large")
+
+            raise ResultTooLarge(f"Result exceeded the {limit} row limit")
+
+        try:
+
+            yield from batch
+
+        except GeneratorExit:
+
+            while cursor.fetchmany(batch_size):
+
+                pass
+
+            raise
+
+
+ 
+
+def consume_result(cursor, fetch, consume, limit=None):
+
+    """Feeds the statement's rows to consume; see execute_statement."""
+
+    if not cursor.with_rows:
+
+        if fetch:
+
+            raise mysql.connector.InterfaceError("No result set to fetch from.")
+
+        return None
+
+    return consume(stream_rows(cursor, limit))
+
+
+ 
+
+def run_statement(cursor, statement, fetch, consume, limit=None):
+
+    """Executes and consumes one statement, tracing the execute and the fetch separately."""
+
+    started = time.perf_counter()
+
+    try:
+
+        cursor.execute(statement)
+
+    finally:
+
+        TRACER.record("execute", started, "statement", sql=statement[:200])
+
+    started = time.perf_counter()
+
+    try:
+
+        return consume_result(cursor, fetch, consume, limit)
+
+    finally:
+
+        TRACER.record("fetch", started, "statement")
+
+ 
+
+# Prepared test statements per connection id: {connection_id: {sql: statement name}}.
+
+# Each connection is only used by one worker at a time, so entries need no lock.
+
+STATEMENT_CACHE = {}
+
+_statement_names = itertools.count(1)
+
+
+ 
+
+# Temporary tables and prepared statements created by graded SQL, per connection id:
+
+# {connection_id: (tables, statement names)}, dropped again by reset_session.
+
+SESSION_LEFTOVERS = {}
+
+
+ 
+
+_SESSION_OBJECT = re.compile(
+
+    r"\bCREATE\s+TEMPORARY\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?((?:`(?:[^`]|``)+`|[\w$]+)(?:\s*\.\s*(?:`(?:[^`]|``)+`|[\w$]+))?)"
+
+    r"|\bPREPARE\s+(`(?:[^`]|``)+`|[\w$]+)\s+FROM\b",
+
+    re.IGNORECASE
+
+)
+
+
+ 
+
+def record_session_objects(connection_id, statement):
+
+    """Notes the temporary tables and prepared statements a graded statement (or routine body) creates."""
+
+    upper = statement.upper()
+
+    if "TEMPORARY" not in upper and "PREPARE" not in upper:
+
+        return
+
+    for table, name in _SESSION_OBJECT.findall(statement):
+
+        tables, names = SESSION_LEFTOVERS.setdefault(connection_id, (set(), set()))
+
+        if table:
+
+            tables.add(table)
+
+        else:
+
+            names.add(name)
+
+ 
+
+# Errors after which a cached statement is prepared again: unknown statement
+
+# handler, a re-prepare demanded by the server, and a routine that was dropped
+
+# since (it may have been re-created).
+
+REPREPARE_ERRNOS = (1243, 1615, 1305)
+
+ 
+
+def prepare_statement(cursor, cache, sql):
+
+    """Prepares sql on the cursor's connection and caches its name; None if it cannot be prepared."""
+
+    name = f"grading_stmt_{next(_statement_names)}"
+
+    try:
+
+        cursor.execute("SET @grading_statement = %s", (sql,))
+
+        cursor.execute(f"PREPARE {name} FROM @grading_statement")
+
+    except mysql.connector.Error as e:
+
+        logging.info(f"Running unprepared, could not prepare {sql[:80]!r}: {e}")
+
+        METRICS.count("statement_prepare_failures")
+
+        return None
+
+    cache[sql] = name
+
+    return name
+
+ 
+
+def run_prepared(cursor, connection_id, statement, fetch, consume, limit=None):
+
+    """
+
+    Runs a test statement from its connection's prepared-statement cache:
+
+    prepared on first use, then sent as EXECUTE. After an error from
+
+    REPREPARE_ERRNOS it is prepared again once; SQL that cannot be prepared
+
+    at all runs as plain text, so errors read exactly as before.
+
+    """
+
+    sql = statement.strip().rstrip(";").strip()
+
+    cache = STATEMENT_CACHE.setdefault(connection_id, {})
+
+    name = cache.get(sql)
+
+    if name is not None:
+
+        METRICS.count("statement_cache_hits")
+
+    else:
+
+        METRICS.count("statement_cache_misses")
+
+        name = prepare_statement(cursor, cache, sql)
+
+        if name is None:
+
+            return run_statement(cursor, statement, fetch, consume, limit)
+
+    try:
+
+        return run_statement(cursor, f"EXECUTE {name}", fetch, consume, limit)
+
+    except mysql.connector.Error as e:
+
+        if e.errno not in REPREPARE_ERRNOS:
+
+            raise
+
+    METRICS.count("statement_reprepares")
+
+    cache.pop(sql, None)
+
+    try:
+
+        cursor.execute(f"DEALLOCATE PREPARE {name}")
+
+    except mysql.connector.Error:
+
+        pass
+
+    name = prepare_statement(cursor, cache, sql)
+
+    if name is None:
+
+        return run_statement(cursor, statement, fetch, consume, limit)
+
+    return run_statement(cursor, f"EXECUTE {name}", fetch, consume, limit)
+
+ 
+
+def execute_statement(cursor, statement, fetch=True, consume=list, prepared=False, limit=None):
+
+    """
+
+    Executes one trainee statement under the current time budget and returns
+
+    consume(rows), where rows streams the result set in bounded batches. With
+
+    fetch=False a statement without a result set returns None instead of
+
+    raising. With prepared, the statement goes through the connection's
+
+    prepared-statement cache (testcase and check SQL repeats for every
+
+    trainee). limit caps the rows read, RESULT_ROW_LIMIT by default and 0 for
+
+    none. Raises StatementTimeout when the statement or the trainee's whole
+
+    budget runs out. Inside confined_to_schema the statement first goes
+
+    through confine_statement: a USE of the graded schema runs nothing, and
+
+    StatementRejected is raised for any other USE or CREATE/DROP DATABASE.
+
+    """
+
+    state = getattr(_grading_budget, "state", None)
+
+    # Graded SQL must not reach the author database, by USE or by a qualified name.
+
+    confinement = getattr(_schema_confinement, "state", None)
+
+    if confinement is not None:
+
+        statement = confine_statement(statement, *confinement)
+
+        if statement is None:
+
+            if fetch:
+
+                raise mysql.connector.InterfaceError("No result set to fetch from.")
+
+            return None
+
+    started = time.perf_counter()
+
+    invalidate_routine_metadata(statement)
+
+    if state is None:
+
+        try:
+
+            return run_statement(cursor, statement, fetch, consume, limit)
+
+        finally:
+
+            METRICS.record_statement(started)
+
+
+ 
+
+    connection_id, deadline = state
+
+    record_session_objects(connection_id, statement)
+
+    remaining = deadline - time.monotonic()
+
+    if remaining <= 0:
+
+        _grading_budget.timeouts = getattr(_grading_budget, "timeouts", 0) + 1
+
+        raise StatementTimeout(f"Trainee time budget of {TRAINEE_TIMEOUT:g}s exhausted")
+
+    timeout = min(STATEMENT_TIMEOUT, remaining)
+
+    with QUERY_WATCHDOG.watch(connection_id, timeout) as watch:
+
+        try:
+
+            if prepared and PREPARED_STATEMENTS:
+
+                return run_prepared(cursor, connection_id, statement, fetch, consume, limit)
+
+            return run_statement(cursor, statement, fetch, consume, limit)
+
+        except mysql.connector.Error as e:
+
+            if watch["killed"] or e.errno in QUERY_TIMEOUT_ERRNOS:
+
+                METRICS.count("statement_timeouts")
+
+                _grading_budget.timeouts = getattr(_grading_budget, "timeouts", 0) + 1
+
+                raise StatementTimeout(f"Statement exceeded its {timeout:g}s time budget and was stopped") from e
+
+            raise
+
+        finally:
+
+            METRICS.record_statement(started)
+
+
+ 
+
+def record_test(outcome, test_id, status, marks=0, started=None, error=None, detail=None):
+
+    """Adds one test outcome to a trainee's entry; does nothing when no entry is being collected."""
+
+    if started is not None:
+
+        TRACER.record(test_id, started, "test", status=status)
+
+    if outcome is None:
+
+        return
+
+    outcome["tests"].append({
+
+        "test_id": test_id,
+
+        "status": status,
+
+        "marks": marks,
+
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3) if started is not None else None,
+
+        "error": error,
+
+        "detail": detail
+
+    })
+
+
+ 
+
+
+ 
+
+def open_results_store(path=None):
+
+    """
+
+    Opens (creating it if needed) the SQLite store with one row per trainee
+
+    and one row per graded test, indexed by trainee and by test.
+
+    """
+
+    store = sqlite3.connect(path or RESULTS_DB_PATH)
+
+    store.executescript("""
+
+        CREATE TABLE IF NOT EXISTS trainee_results (
+
+            trainee TEXT PRIMARY KEY,
+
+            scores TEXT NOT NULL,
+
+            log TEXT NOT NULL,
+
+            graded_at TEXT NOT NULL
+
+        );
+
+        CREATE TABLE IF NOT EXISTS test_results (
+
+            trainee TEXT NOT NULL,
+
+            test_id TEXT NOT NULL,
+
+            status TEXT NOT NULL,
+
+            marks REAL NOT NULL,
+
+            elapsed_ms REAL,
+
+            error TEXT,
+
+            detail TEXT,
+
+            PRIMARY KEY (trainee, test_id)
+
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_test_results_test ON test_results (test_id, status);
+
+    """)
+
+    return store
+
+
+ 
+
+
+ 
+
+def save_trainee_results(store, entry):
+
+    """Replaces everything stored for one trainee with the given entry."""
+
+    trn_id = entry["trn_id"]
+
+    with store:
+
+        store.execute("DELETE FROM test_results WHERE trainee = ?", (trn_id,))
+
+        store.execute(
+
+            "INSERT OR REPLACE INTO trainee_results VALUES (?, ?, ?, ?)",
+
+            (trn_id, json.dumps(entry["scores"]), entry["log"], time.strftime("%Y-%m-%d %H:%M:%S"))
+
+        )
+
+        store.executemany(
+
+            "INSERT OR REPLACE INTO test_results VALUES (?, ?, ?, ?, ?, ?, ?)",
+
+            [
+
+                (trn_id, test["test_id"], test["status"], test["marks"], test["elapsed_ms"], test["error"], test["detail"])
+
+                for test in entry.get("tests", [])
+
+            ]
+
+        )
+
+
+ 
+
+
+ 
+
+def parse_marks(value):
+
+    """Marks from the author .env as a number (they are stored as text)."""
+
+    if value is None:
+
+        return 0
+
+    try:
+
+        return int(value)
+
+    except ValueError:
+
+        return float(value)
+
+
+ 
+
+
+ 
+
+class ScoreboardWriter:
+
+    """
+
+    Streams one scoreboard row per trainee as soon as it is graded: xlsx in
+
+    openpyxl write-only mode, CSV, and Parquet when pyarrow is installed.
+
+    Nothing is kept per trainee, so memory stays flat for any cohort size.
+
+    """
+
+
+ 
+
+    def __init__(self, output_base, query_files, formats=None):
+
+        formats = SCOREBOARD_FORMATS if formats is None else formats
+
+        self.output_base = output_base
+
+        self.query_files = sorted(query_files)
+
+        self.header = (
+
+            ["Trainee ID"]
+
+            + [f"{query}_res" for query in self.query_files]
+
+            + ["Function marks", "Procedure marks", "Total marks"]
+
+        )
+
+
+ 
+
+        self.workbook = None
+
+        self.csv_file = None
+
+        self.parquet_writer = None
+
+        self.parquet_rows = []
+
+
+ 
+
+        if "xlsx" in formats:
+
+            from openpyxl import Workbook
+
+            self.workbook = Workbook(write_only=True)
+
+            self.sheet = self.workbook.create_sheet("Trainee Results")
+
+            self.sheet.append(self.header)
+
+
+ 
+
+        if "csv" in formats:
+
+            self.csv_file = open(f"{output_base}.csv", 'w', newline='')
+
+            self.csv_writer = csv.writer(self.csv_file)
+
+            self.csv_writer.writerow(self.header)
+
+
+ 
+
+        if "parquet" in formats:
+
+            try:
+
+                import pyarrow
+
+                import pyarrow.parquet
+
+            except ImportError:
+
+                logging.warning("pyarrow is not installed, skipping the Parquet scoreboard.")
+
+            else:
+
+                self.pyarrow = pyarrow
+
+                self.parquet_schema = pyarrow.schema(
+
+                    [(self.header[0], pyarrow.string())]
+
+                    + [(column, pyarrow.float64()) for column in self.header[1:]]
+
+                )
+
+                self.parquet_writer = pyarrow.parquet.ParquetWriter(f"{output_base}.parquet", self.parquet_schema)
+
+
+ 
+
+    def append(self, trn_id, scores):
+
+        query_marks = [scores.get(query, 0) for query in self.query_files]
+
+        fun_marks = scores.get("functions", 0)
+
+        proc_marks = scores.get("procedures", 0)
+
+        row = [trn_id] + query_marks + [fun_marks, proc_marks, sum(query_marks) + fun_marks + proc_marks]
+
+
+ 
+
+        if self.workbook is not None:
+
+            self.sheet.append(row)
+
+
+ 
+
+        if self.csv_file is not None:
+
+            self.csv_writer.writerow(row)
+
+            self.csv_file.flush()
+
+
+ 
+
+        if self.parquet_writer is not None:
+
+            self.parquet_rows.append(row)
+
+            if len(self.parquet_rows) >= SCOREBOARD_PARQUET_BATCH:
+
+                self._flush_parquet()
+
+
+ 
+
+    def _flush_parquet(self):
+
+        if not self.parquet_rows:
+
+            return
+
+        columns = list(zip(*self.parquet_rows))
+
+        arrays = [self.pyarrow.array(columns[0], self.pyarrow.string())]
+
+        arrays += [self.pyarrow.array([float(value) for value in column], self.pyarrow.float64()) for column in columns[1:]]
+
+        self.parquet_writer.write_table(self.pyarrow.Table.from_arrays(arrays, schema=self.parquet_schema))
+
+        self.parquet_rows = []
+
+
+ 
+
+    def close(self):
+
+        started = time.perf_counter()
+
+        if self.workbook is not None:
+
+            self.workbook.save(f"{self.output_base}.xlsx")
+
+            self.workbook = None
+
+        if self.csv_file is not None:
+
+            self.csv_file.close()
+
+            self.csv_file = None
+
+        if self.parquet_writer is not None:
+
+            self._flush_parquet()
+
+            self.parquet_writer.close()
+
+            self.parquet_writer = None
+
+        METRICS.record_phase("scoreboard_save", started)
+
+        logging.info(f"Scoreboard '{self.output_base}' written.")
+
+
+ 
+
+    def __enter__(self):
+
+        return self
+
+
+ 
+
+    def __exit__(self, exc_type, exc, tb):
+
+        self.close()
+
+
+ 
+
+
+ 
+
+def write_results_to_excel(output_file="Trainees_marks.xlsx", author_index=None, store_path=None):
+
+    """Rebuilds the scoreboard from the results store without re-grading anyone."""
+
+    if author_index is None:
+
+        author_index = build_author_output_index()
+
+    output_base = os.path.splitext(output_file)[0]
+
+
+ 
+
+    with closing(open_results_store(store_path)) as store, ScoreboardWriter(output_base, author_index.keys()) as scoreboard:
+
+        for trn_id, scores in store.execute("SELECT trainee, scores FROM trainee_results ORDER BY trainee"):
+
+            scoreboard.append(trn_id, json.loads(scores))
+
+
+ 
+
+    logging.info(f"Excel file '{output_file}' created with trainee results.")
+
+    print(f"Excel file '{output_file}' created with trainee results.")
+
+
+ 
+
+def generate_expected_output(cursor):
+
+    with open(f'{AUTHOR_PATH}/Testcases/fun_testcases.json', 'r') as f:
+
+        json_data = json.load(f)
+
+
+ 
+
+   
+
+    meta_data = json_data.get("meta_data", {})
+
+    test_cases = json_data.get("tests", [])
+
+
+ 
+
+    for case in test_cases:
+
+        call = case['function_call']
+
+        try:
+
+            rows = execute_statement(cursor, call, limit=0)
+
+            result = []
+
+            for row in rows:
+
+                result.append(str(row[0]))
+
+            case["Expected"] = str(result) if result else None
+
+        except Exception as e:
+
+            case['Expected'] = f"Error: {e}"
+
+            print(e)
+
+            logging.error(f"Error generating expected output for function {call}: {e}")
+
+
+ 
+
+         
+
+    updated_data = {
+
+        "meta_data": meta_data,
+
+        "tests": test_cases
+
+    }
+
+
+ 
+
+    with open(f'{AUTHOR_PATH}/Testcases/fun_testcases.json', 'w') as f:
+
+       
+
+        json.dump(updated_data, f, indent = 4)
+
+   
+
+    logging.info("Expected outputs added to fun_testcases.json")
+
+    print("Expected outputs added to fun_tesrcases.json")
+
+
+
+
+ 
+
+def generate_procedure_test(cursor):
+
+
+ 
+
+
+
+    with open(f'{AUTHOR_PATH}/Testcases/proc_testcases.json', 'r') as f:
+
+        json_data = json.load(f)
+
+
+ 
+
+   
+
+    meta_data = json_data.get("meta_data", {})
+
+    test_cases = json_data.get("tests", [])
+
+
+ 
+
+    for case in test_cases:
+
+        try:
+
+            cursor.execute("START TRANSACTION")
+
+            rows = execute_statement(cursor, case["procedure_call"], limit=0)
+
+            case["Expected"] = result_fingerprint(rows)
+
+
+ 
+
+            for check in case.get("checks", []):
+
+                try:
+
+                    rows = execute_statement(cursor, check["query"], limit=0)
+
+                    check["Expected"] = result_fingerprint(rows)
+
+                except Exception as e:
+
+                    check["Expected"] = f"Error: {e}"
+
+
+ 
+
+            cursor.execute("ROLLBACK")
+
+        except Exception as e:
+
+            cursor.execute("ROLLBACK")
+
+            case["Expected"] = f"Error: {e}"
+
+
+ 
+
+    updated_data = {
+
+        "meta_data": meta_data,
+
+        "tests": test_cases
+
+    }
+
+
+ 
+
+    with open(f'{AUTHOR_PATH}/Testcases/proc_testcases.json', 'w') as f:
+
+        json.dump(updated_data, f, indent=4)
+
+
+ 
+
+    logging.info("Procedure test expected output generated.")
+
+
+
+
+ 
+
+def freeze(value):
+
+    """Recursively turns dicts into read-only mappings and lists into tuples."""
+
+    if isinstance(value, dict):
+
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+
+    if isinstance(value, (list, tuple)):
+
+        return tuple(freeze(item) for item in value)
+
+    return value
+
+
+ 
+
+
+ 
+
+def compile_test_plan():
+
+    """
+
+    Loads the function/procedure testcases (with their generated expected
+
+    results), the author marks and the author output index once per run.
+
+    The returned plan is read-only and shared by every grading path and worker.
+
+    """
+
+    with open(f'{AUTHOR_PATH}/Testcases/fun_testcases.json', 'r') as f:
+
+        fun_data = json.load(f)
+
+
+ 
+
+    with open(f'{AUTHOR_PATH}/Testcases/proc_testcases.json', 'r') as f:
+
+        proc_data = json.load(f)
+
+
+ 
+
+    marks_dict = dict(dotenv_values(f"{AUTHOR_PATH}/.env"))
+
+
+ 
+
+    test_plan = {
+
+        "functions": {
+
+            "meta_data": fun_data.get("meta_data", {}),
+
+            "tests": fun_data.get("tests", [])
+
+        },
+
+        "procedures": {
+
+            "meta_data": proc_data.get("meta_data", {}),
+
+            "tests": proc_data.get("tests", [])
+
+        },
+
+        "marks": marks_dict,
+
+        "author_outputs": build_author_output_index(),
+
+        "fixture_digest": file_digest(f'{AUTHOR_PATH}/sample_db.txt')
+
+    }
+
+
+ 
+
+    # Anything that can change a trainee's result feeds the plan digest.
+
+    test_plan["digest"] = hashlib.sha256(
+
+        json.dumps(test_plan, sort_keys=True, default=str).encode("utf-8")
+
+    ).hexdigest()
+
+
+ 
+
+    logging.info("Test plan compiled.")
+
+    return freeze(test_plan)
+
+
+
+
+ 
+
+def run_trainee_procedures(cursor, content, trn_id, test_plan, outcome=None):
+
+    if content is None:
+
+        return "execute successfully"
+
+
+ 
+
+    output_lines = []
+
+    total_marks = 0
+
+
+ 
+
+    try:
+
+        meta_data = test_plan["procedures"]["meta_data"]
+
+        test_cases = test_plan["procedures"]["tests"]
+
+
+ 
+
+        statements = split_sql_statements(content)
+
+        for statement in statements:
+
+            if statement.strip():
+
+                execute_statement(cursor, statement, fetch=False)
+
+
+ 
+
+        routine_type, routine_name = get_routine_type_and_name(content)
+
+        # Parameters and return type come from one cached INFORMATION_SCHEMA lookup.
+
+        routine = load_routine_metadata(cursor).get((routine_type, (routine_name or "").lower()))
+
+        params = routine["parameters"] if routine else []
+
+
+ 
+
+        output_lines.append("\nMetadata Checks:")
+
+
+ 
+
+        expected_routine_name = meta_data.get("routine_name")
+
+        name_marks = meta_data.get("routine_name_marks", 0)
+
+        if routine_name == expected_routine_name:
+
+            output_lines.append("  Routine Name: Passed")
+
+            output_lines.append(f"  marks: {name_marks}")
+
+            total_marks += name_marks
+
+            record_test(outcome, "procedure:routine_name", "Passed", name_marks)
+
+        else:
+
+            output_lines.append("  Routine Name: Failed")
+
+            output_lines.append(f"    Expected: {expected_routine_name}")
+
+            output_lines.append(f"    Actual:   {routine_name}")
+
+            record_test(outcome, "procedure:routine_name", "Failed", detail=f"Expected: {expected_routine_name}, Actual: {routine_name}")
+
+
+ 
+
+        expected_type = meta_data.get("routine_type")
+
+        type_marks = meta_data.get("routine_type_marks", 0)
+
+        if routine_type.upper() == expected_type.upper():
+
+            output_lines.append("  Routine Type: Passed")
+
+            output_lines.append(f"  marks: {type_marks}")
+
+            total_marks += type_marks
+
+            record_test(outcome, "procedure:routine_type", "Passed", type_marks)
+
+        else:
+
+            output_lines.append("  Routine Type: Failed")
+
+            output_lines.append(f"    Expected: {expected_type}")
+
+            output_lines.append(f"    Actual:   {routine_type}")
+
+            record_test(outcome, "procedure:routine_type", "Failed", detail=f"Expected: {expected_type}, Actual: {routine_type}")
+
+
+ 
+
+        expected_params = meta_data.get("parameters", [])
+
+        param_marks = meta_data.get("parameters_marks", 0)
+
+
+ 
+
+        def normalize_param(p):
+
+            return {
+
+                "mode": p["mode"].upper(),
+
+                "name": p["name"].lower(),
+
+                "type": p["type"].lower()
+
+            }
+
+
+ 
+
+        expected_normalized = [normalize_param(p) for p in expected_params]
+
+        actual_normalized = [normalize_param(p) for p in params]
+
+
+ 
+
+        if expected_normalized == actual_normalized:
+
+            output_lines.append("  Parameters: Passed")
+
+            output_lines.append(f"  marks: {param_marks}")
+
+            total_marks += param_marks
+
+            record_test(outcome, "procedure:parameters", "Passed", param_marks)
+
+        else:
+
+            output_lines.append("  Parameters: Failed")
+
+            output_lines.append(f"    Expected: {expected_normalized}")
+
+            output_lines.append(f"    Actual:   {actual_normalized}")
+
+            record_test(outcome, "procedure:parameters", "Failed", detail=f"Expected: {expected_normalized}, Actual: {actual_normalized}")
+
+
+ 
+
+        for idx, case in enumerate(test_cases, 1):
+
+            output_lines.append(f"\nTestcase {idx}:")
+
+            proc_call = case["procedure_call"]
+
+
+ 
+
+            started = time.perf_counter()
+
+            try:
+
+                cursor.execute("START TRANSACTION")
+
+                expected = case.get("Expected")
+
+                expected_count = expected_row_count(expected)
+
+                fingerprint = execute_statement(
+
+                    cursor, proc_call, consume=lambda rows: result_fingerprint(rows, expected_count), prepared=True,
+
+                    limit=trainee_row_limit(expected_count)
+
+                )
+
+                status = "Passed" if fingerprint_matches(fingerprint, expected) else "Failed"
+
+                marks_awarded = case.get("marks", 0) if status == "Passed" else 0
+
+                total_marks += marks_awarded
+
+                output_lines.append(f"  Status: {status}")
+
+                output_lines.append(f"  marks: {marks_awarded}")
+
+                if status == "Failed":
+
+                    output_lines.append(f"    Procedure Call: {proc_call}")
+
+                    output_lines.append(f"    Expected: {describe_fingerprint(expected)}")
+
+                    output_lines.append(f"    Actual:   {describe_fingerprint(fingerprint)}")
+
+                record_test(
+
+                    outcome, f"procedure:test_{idx}", status, marks_awarded, started,
+
+                    detail=None if status == "Passed" else f"Expected: {describe_fingerprint(expected)}, Actual: {describe_fingerprint(fingerprint)}"
+
+                )
+
+
+ 
+
+            except Exception as e:
+
+                cursor.execute("ROLLBACK")
+
+                output_lines.append("  Status: Failed")
+
+                output_lines.append(f"    Procedure Call: {proc_call}")
+
+                output_lines.append(f"    Error: {e}")
+
+                record_test(outcome, f"procedure:test_{idx}", "Failed", 0, started, str(e))
+
+                continue
+
+
+ 
+
+            if "checks" in case:
+
+                output_lines.append("  Checks:")
+
+                for check_idx, check in enumerate(case["checks"], 1):
+
+                    check_id = f"procedure:test_{idx}:check_{check_idx}"
+
+                    started = time.perf_counter()
+
+                    try:
+
+                        check_expected = check.get("Expected")
+
+                        expected_count = expected_row_count(check_expected)
+
+                        fingerprint = execute_statement(
+
+                            cursor, check["query"], consume=lambda rows: result_fingerprint(rows, expected_count), prepared=True,
+
+                            limit=trainee_row_limit(expected_count)
+
+                        )
+
+                        check_status = "Passed" if fingerprint_matches(fingerprint, check_expected) else "Failed"
+
+                        marks_awarded = check.get("marks", 0) if check_status == "Passed" else 0
+
+                        total_marks += marks_awarded
+
+
+ 
+
+                        output_lines.append(f"    Check {check_idx}: {check_status}")
+
+                        output_lines.append(f"    marks: {marks_awarded}")
+
+                        if check_status == "Failed":
+
+                            output_lines.append(f"      Query: {check['query']}")
+
+                            output_lines.append(f"      Expected: {describe_fingerprint(check_expected)}")
+
+                            output_lines.append(f"      Actual:   {describe_fingerprint(fingerprint)}")
+
+                        record_test(
+
+                            outcome, check_id, check_status, marks_awarded, started,
+
+                            detail=None if check_status == "Passed" else f"Expected: {describe_fingerprint(check_expected)}, Actual: {describe_fingerprint(fingerprint)}"
+
+                        )
+
+
+ 
+
+                    except Exception as e:
+
+                        output_lines.append(f"    Check {check_idx}: Failed")
+
+                        output_lines.append(f"      Query: {check['query']}")
+
+                        output_lines.append(f"      Error: {e}")
+
+                        record_test(outcome, check_id, "Failed", 0, started, str(e))
+
+
+ 
+
+        cursor.execute("ROLLBACK")
+
+        output_lines.append(f"\nTotal marks for procedures: {total_marks}")
+
+        if outcome is not None:
+
+            outcome["scores"]["procedures"] = total_marks
+
+        return "\n".join(output_lines)
+
+
+ 
+
+    except Exception as e:
+
+        record_test(outcome, "procedure:error", "Failed", error=str(e))
+
+        return f"Error executing procedures: {e}"
+
+
+ 
+
+_SQL_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`")
+
+_ROW_CLAUSE = re.compile(r"\b(FROM|WHERE|HAVING|LIMIT|UNION|INTO|GROUP|ORDER|WINDOW)\b|;", re.IGNORECASE)
+
+ 
+
+def scalar_select(call):
+
+    """
+
+    The call without its trailing semicolon when it is a SELECT of
+
+    expressions only (no FROM, WHERE, ...), which always returns exactly one
+
+    row; None otherwise.
+
+    """
+
+    select = call.strip().rstrip(";").strip()
+
+    if not re.match(r"SELECT\b", select, re.IGNORECASE):
+
+        return None
+
+    if _ROW_CLAUSE.search(_SQL_LITERAL.sub("''", select)):
+
+        return None
+
+    return select
+
+ 
+
+def batch_function_calls(cursor, calls):
+
+    """
+
+    Evaluates all function calls in one round trip, as one SELECT with a
+
+    scalar subquery column per call. Returns one result per call, shaped like
+
+    a single call's ([str(value)]), or None when a call cannot be batched or
+
+    the combined statement fails. The caller then runs each call on its own,
+
+    so a failing call still gets its own error message.
+
+    """
+
+    selects = [scalar_select(call) for call in calls]
+
+    if len(selects) < 2 or None in selects:
+
+        return None
+
+    columns = ", ".join(f"({select}) AS `test_{idx}`" for idx, select in enumerate(selects, 1))
+
+    try:
+
+        cursor.execute("SAVEPOINT function_batch")
+
+        rows = execute_statement(cursor, f"SELECT {columns}", prepared=True)
+
+    except Exception as e:
+
+        logging.info(f"Batched function calls failed, running them one by one: {e}")
+
+        METRICS.count("function_batch_fallbacks")
+
+        try:
+
+            # Undo whatever the calls evaluated before the failure did.
+
+            cursor.execute("ROLLBACK TO SAVEPOINT function_batch")
+
+        except mysql.connector.Error:
+
+            pass
+
+        return None
+
+    METRICS.count("function_batches")
+
+    return [[str(value)] for value in rows[0]]
+
+ 
+
+
+ 
+
+def run_trainee_functions(cursor, content, trn_id, test_plan, outcome=None):
+
+
+ 
+
+    if content is None:
+
+        return "execute successfully"
+
+
+ 
+
+    output_lines = []
+
+    total_marks = 0
+
+    try:
+
+        meta_data = test_plan["functions"]["meta_data"]
+
+        test_cases = test_plan["functions"]["tests"]
+
+
+ 
+
+        statements = split_sql_statements(content)
+
+        for statement in statements:
+
+            if statement.strip():
+
+                execute_statement(cursor, statement, fetch=False)
+
+
+ 
+
+        output_lines.append("\nMetadata Checks:")
+
+
+ 
+
+        routine_type, routine_name = get_routine_type_and_name(content)
+
+        # Parameters and return type come from one cached INFORMATION_SCHEMA lookup.
+
+        routine = load_routine_metadata(cursor).get((routine_type, (routine_name or "").lower()))
+
+        params = routine["parameters"] if routine else []
+
+
+ 
+
+        def normalize_param(p):
+
+            return {
+
+                "mode": p["mode"].upper() if p["mode"] else "IN",
+
+                "name": p["name"].lower() if p["name"] else None,
+
+                "type": p["type"].lower()
+
+            }
+
+
+ 
+
+        expected_routine_name = meta_data.get("routine_name")
+
+        name_marks = meta_data.get("routine_name_marks", 0)
+
+        if routine_name == expected_routine_name:
+
+            output_lines.append("  Routine Name: Passed")
+
+            output_lines.append(f"  marks: {name_marks}")
+
+            total_marks += name_marks
+
+            record_test(outcome, "function:routine_name", "Passed", name_marks)
+
+        else:
+
+            output_lines.append("  Routine Name: Failed")
+
+            output_lines.append(f"    Expected: {expected_routine_name}")
+
+            output_lines.append(f"    Actual:   {routine_name}")
+
+            record_test(outcome, "function:routine_name", "Failed", detail=f"Expected: {expected_routine_name}, Actual: {routine_name}")
+
+
+ 
+
+        expected_type = meta_data.get("routine_type")
+
+        type_marks = meta_data.get("routine_type_marks", 0)
+
+        if routine_type.upper() == expected_type.upper():
+
+            output_lines.append("  Routine Type: Passed")
+
+            output_lines.append(f"  marks: {type_marks}")
+
+            total_marks += type_marks
+
+            record_test(outcome, "function:routine_type", "Passed", type_marks)
+
+        else:
+
+            output_lines.append("  Routine Type: Failed")
+
+            output_lines.append(f"    Expected: {expected_type}")
+
+            output_lines.append(f"    Actual:   {routine_type}")
+
+            record_test(outcome, "function:routine_type", "Failed", detail=f"Expected: {expected_type}, Actual: {routine_type}")
+
+
+ 
+
+        expected_params = meta_data.get("parameters", [])
+
+        param_marks = meta_data.get("parameters_marks", 0)
+
+
+ 
+
+        expected_normalized = [normalize_param(p) for p in expected_params]
 
         actual_normalized = [normalize_param(p) for p in params]
 
 
  
 
-        if expected_normalized == actual_normalized:
+        if expected_normalized == actual_normalized:
+
+            output_lines.append("  Parameters: Passed")
+
+            output_lines.append(f"  marks: {param_marks}")
+
+            total_marks += param_marks
+
+            record_test(outcome, "function:parameters", "Passed", param_marks)
+
+        else:
+
+            output_lines.append("  Parameters: Failed")
+
+            output_lines.append(f"    Expected: {expected_normalized}")
+
+            output_lines.append(f"    Actual:   {actual_normalized}")
+
+            record_test(outcome, "function:parameters", "Failed", detail=f"Expected: {expected_normalized}, Actual: {actual_normalized}")
+
+
+ 
+
+        expected_return_type = normalize_sql_type(meta_data.get("return_type", ""))
+
+        return_type_marks = meta_data.get("return_type_marks", 0)
+
+
+ 
+
+        actual_return_type = normalize_sql_type(routine["return_type"]) if routine and routine["return_type"] else "unknown"
+
+
+ 
+
+        if expected_return_type == actual_return_type:
+
+            output_lines.append("  Return Type: Passed")
+
+            output_lines.append(f"  marks: {return_type_marks}")
+
+            total_marks += return_type_marks
+
+            record_test(outcome, "function:return_type", "Passed", return_type_marks)
+
+        else:
+
+            output_lines.append("  Return Type: Failed")
+
+            output_lines.append(f"    Expected: {expected_return_type}")
+
+            output_lines.append(f"    Actual:   {actual_return_type}")
+
+            record_test(outcome, "function:return_type", "Failed", detail=f"Expected: {expected_return_type}, Actual: {actual_return_type}")
+
+
+ 
+
+        # One round trip for every testcase when possible; per-call execution otherwise.
+
+        # Whatever the calls change is rolled back once every testcase has run.
+
+        cursor.execute("SAVEPOINT function_tests")
+
+        batched = batch_function_calls(cursor, [case['function_call'] for case in test_cases]) if FUNCTION_BATCHING else None
+
+
+ 
+
+        for idx, case in enumerate(test_cases, 1):
+
+            call = case['function_call']
+
+            expected = case.get("Expected")
+
+            started = time.perf_counter()
+
+            error = None
+
+            try:
+
+                if batched is not None:
+
+                    result = batched[idx - 1]
+
+                else:
+
+                    result = execute_statement(cursor, call, consume=lambda rows: [str(row[0]) for row in rows], prepared=True)
+
+                status = "Passed" if str(result) == expected else "Failed"
+
+            except Exception as e:
+
+                result = f"Error: {e}"
+
+                status = "Failed"
+
+                error = str(e)
+
+
+ 
+
+            marks_awarded = int(case["marks"]) if status == "Passed" else 0
+
+            total_marks += marks_awarded
+
+            output_lines.append(f"\nTestcase {idx}:")
+
+            output_lines.append(f"  Status: {status}")
+
+            output_lines.append(f"  marks: {marks_awarded}")
+
+            if status == "Failed":
+
+                output_lines.append(f"    Function Call: {call}")
+
+                output_lines.append(f"    Expected: {expected}")
+
+                output_lines.append(f"    Actual:   {result}")
+
+            record_test(
+
+                outcome, f"function:test_{idx}", status, marks_awarded, started, error,
+
+                None if status == "Passed" else f"Expected: {expected}, Actual: {result}"
+
+            )
+
+
+ 
+
+        try:
+
+            cursor.execute("ROLLBACK TO SAVEPOINT function_tests")
+
+        except mysql.connector.Error as e:
+
+            logging.warning(f"Could not roll back function test changes for {trn_id}: {e}")
+
+        output_lines.append(f"\nTotal marks for functions: {total_marks}")
+
+        if outcome is not None:
+
+            outcome["scores"]["functions"] = total_marks
+
+        return "\n".join(output_lines)
+
+
+ 
+
+    except Exception as e:
+
+        record_test(outcome, "function:error", "Failed", error=str(e))
+
+        return f"Error executing functions: {e}"
+
+
+ 
+
+def execute_author_queries(cursor):
+
+    """
+
+    Loads sample_db.txt into the author database, then writes the expected
+
+    output of each author query file. The files run on a fixture clone with
+
+    the same per-file isolation as a trainee's, so expected and actual
+
+    results start from the same data.
+
+    """
+
+    with open("logfile/execution.log", 'a') as log_file:
+
+ 
+
+        execute_commands(f'{AUTHOR_PATH}/sample_db.txt',cursor,log_file, is_author = True)
+
+ 
+
+        os.makedirs(f'{AUTHOR_PATH}/output', exist_ok=True)
+
+ 
+
+        schema = author_schema_name()
+
+        use_worker_schema(cursor, schema)
+
+        try:
+
+            reset_worker_schema(cursor, schema)
+
+            queries_dir = f'{AUTHOR_PATH}/queries'
+
+            # The author's SQL gets the same USE handling as a trainee's.
+
+            with confined_to_schema(cursor, schema):
+
+                for query_file in os.listdir(queries_dir):
+
+                    if query_file.endswith(".txt"):
+
+                        file_path = os.path.join(queries_dir,query_file)
+
+                        output_path = os.path.join(f"{AUTHOR_PATH}/output", query_file)
+
+                        with open(file_path, 'r') as f:
+
+                            content = tuple(split_sql_statements(f))
+
+                        with isolate_graded_file(cursor, schema, content):
+
+                            execute_commands(file_path, cursor,log_file,is_author=True, output_path=output_path, content=content)
+
+            cursor.execute("COMMIT")
+
+        finally:
+
+            cursor.execute(f"USE `{DB_CONFIG['database']}`")
+
+ 
+
+
+ 
+
+def author_schema_name():
+
+    """Fixture clone the author's query files run in."""
+
+    return f"{DB_CONFIG['database']}_author"
+
+
+
+ 
+
+def fixture_schema_name():
+
+    """Schema holding the pristine sample_db.txt state that worker schemas are cloned from."""
+
+    return f"{DB_CONFIG['database']}_fixture"
+
+
+ 
+
+
+ 
+
+def worker_schema_name(index):
+
+    """Isolated schema a grading worker runs trainee SQL in."""
+
+    return f"{DB_CONFIG['database']}_worker_{index}"
+
+
+ 
+
+
+ 
+
+def build_fixture_schema(cursor):
+
+    """Replays sample_db.txt once into a fresh fixture schema."""
+
+    fixture = fixture_schema_name()
+
+    with _fixture_definitions_lock:
+
+        FIXTURE_DEFINITIONS.pop(fixture, None)
+
+    cursor.execute(f"DROP DATABASE IF EXISTS `{fixture}`")
+
+    cursor.execute(f"CREATE DATABASE `{fixture}`")
+
+    cursor.execute(f"USE `{fixture}`")
+
+
+ 
+
+    try:
+
+        with open(f'{AUTHOR_PATH}/sample_db.txt', 'r') as f:
+
+            for command in split_sql_statements(f):
+
+                # The replay has to stay inside the fixture schema.
+
+                if _SCHEMA_SWITCH.match(command):
+
+                    continue
+
+                command = confine_statement(command, fixture)
+
+
+ 
+
+                try:
+
+                    cursor.execute(command)
+
+                    if cursor.with_rows:
+
+                        cursor.fetchall()
+
+                except Exception as e:
+
+                    logging.error(f"Error building fixture schema: {e}")
+
+
+ 
+
+        cursor.execute("COMMIT")
+
+
+ 
+
+    finally:
+
+        cursor.execute(f"USE `{DB_CONFIG['database']}`")
+
+
+ 
+
+    logging.info(f"Fixture schema '{fixture}' built from sample_db.txt")
+
+
+ 
+
+
+ 
+
+def use_worker_schema(cursor, schema):
+
+    """Creates the worker schema if needed and makes it the session default."""
+
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{schema}`")
+
+    cursor.execute(f"USE `{schema}`")
+
+    invalidate_routine_metadata()
+
+
+ 
+
+
+ 
+
+# Session settings graded SQL may change that later results depend on; reset_session
+
+# puts them back to the server defaults. Character sets stay, the connector set those.
+
+SESSION_DEFAULTS = (
+
+    "sql_mode", "foreign_key_checks", "unique_checks", "sql_safe_updates", "sql_select_limit",
+
+    "sql_auto_is_null", "time_zone", "group_concat_max_len", "div_precision_increment",
+
+    "transaction_isolation", "lc_time_names", "default_week_format"
+
+)
+
+
+ 
+
+def reset_session(connection, cursor, schema):
+
+    """
+
+    Gives the next trainee a clean session on a reused connection without
+
+    COM_RESET_CONNECTION, which would also free the prepared statements the
+
+    connection caches for every trainee (STATEMENT_CACHE). The transaction is
+
+    rolled back, user variables set to NULL, the temporary tables and prepared
+
+    statements of graded SQL dropped and the SESSION_DEFAULTS settings put
+
+    back; autocommit is turned off again, so savepoints work, and the worker
+
+    schema selected. Without performance_schema the user variables cannot be
+
+    listed, and the connection is reset as a whole instead.
+
+    """
+
+    cursor.execute("ROLLBACK")
+
+    cursor.execute("SELECT CONNECTION_ID()")
+
+    connection_id = cursor.fetchone()[0]
+
+    tables, names = SESSION_LEFTOVERS.pop(connection_id, ((), ()))
+
+    try:
+
+        cursor.execute(
+
+            "SELECT VARIABLE_NAME FROM performance_schema.user_variables_by_thread WHERE THREAD_ID = PS_CURRENT_THREAD_ID()"
+
+        )
+
+        variables = [str(name) for (name,) in cursor.fetchall()]
+
+    except mysql.connector.Error as e:
+
+        logging.info(f"Resetting the whole connection, user variables cannot be listed: {e}")
+
+        METRICS.count("session_full_resets")
+
+        connection.cmd_reset_connection()
+
+        STATEMENT_CACHE.pop(connection_id, None)
+
+    else:
+
+        cursor.execute(f"USE `{schema}`")
+
+        for table in tables:
+
+            cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {table}")
+
+        for name in names:
+
+            try:
+
+                cursor.execute(f"DEALLOCATE PREPARE {name}")
+
+            except mysql.connector.Error:
+
+                # The PREPARE itself failed, or the statement was deallocated already.
+
+                pass
+
+        if variables:
+
+            cursor.execute("SET " + ", ".join("@`{}` = NULL".format(name.replace("`", "``")) for name in variables))
+
+        cursor.execute("SET SESSION " + ", ".join(f"{setting} = DEFAULT" for setting in SESSION_DEFAULTS))
+
+    cursor.execute("SET autocommit = 0")
+
+    cursor.execute(f"USE `{schema}`")
+
+    invalidate_routine_metadata()
+
+ 
+
+
+# CREATE statements of the fixture per fixture schema, read once and cleared on rebuild.
+
+FIXTURE_DEFINITIONS = {}
+
+_fixture_definitions_lock = threading.Lock()
+
+ 
+
+def fixture_definitions(cursor):
+
+    """
+
+    The fixture's tables, views, triggers and routines as SHOW CREATE gives
+
+    them, so clones keep foreign keys, triggers and routines that
+
+    CREATE TABLE ... LIKE would drop. Read once per run.
+
+    """
+
+    fixture = fixture_schema_name()
+
+    with _fixture_definitions_lock:
+
+        definitions = FIXTURE_DEFINITIONS.get(fixture)
+
+    if definitions is not None:
+
+        return definitions
+
+    definitions = {"tables": [], "views": [], "triggers": [], "routines": []}
+
+ 
+
+    cursor.execute(
+
+        "SELECT TABLE_NAME, TABLE_TYPE FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = %s ORDER BY TABLE_NAME",
+
+        (fixture,)
+
+    )
+
+    for table_name, table_type in cursor.fetchall():
+
+        kind = "VIEW" if table_type == "VIEW" else "TABLE"
+
+        cursor.execute(f"SHOW CREATE {kind} `{fixture}`.`{table_name}`")
+
+        definitions["views" if kind == "VIEW" else "tables"].append((table_name, cursor.fetchone()[1]))
+
+ 
+
+    cursor.execute(
+
+        "SELECT TRIGGER_NAME FROM INFORMATION_SCHEMA.TRIGGERS WHERE TRIGGER_SCHEMA = %s ORDER BY EVENT_OBJECT_TABLE, ACTION_ORDER",
+
+        (fixture,)
+
+    )
+
+    for (trigger_name,) in cursor.fetchall():
+
+        cursor.execute(f"SHOW CREATE TRIGGER `{fixture}`.`{trigger_name}`")
+
+        definitions["triggers"].append((trigger_name, cursor.fetchone()[2]))
+
+ 
+
+    cursor.execute(
+
+        "SELECT ROUTINE_TYPE, ROUTINE_NAME FROM INFORMATION_SCHEMA.ROUTINES WHERE ROUTINE_SCHEMA = %s ORDER BY ROUTINE_NAME",
+
+        (fixture,)
+
+    )
+
+    for routine_type, routine_name in cursor.fetchall():
+
+        cursor.execute(f"SHOW CREATE {routine_type} `{fixture}`.`{routine_name}`")
+
+        definitions["routines"].append((routine_name, cursor.fetchone()[2]))
+
+ 
+
+    with _fixture_definitions_lock:
+
+        FIXTURE_DEFINITIONS[fixture] = definitions
+
+    return definitions
+
+ 
+
+
+ 
+
+def reset_worker_schema(cursor, schema, keep_routines=False):
+
+    """
+
+    Drops everything a trainee left in the schema and re-clones the fixture:
+
+    tables with their keys and rows, views, triggers and, unless
+
+    keep_routines is set, routines. With keep_routines the trainee's
+
+    functions and procedures stay, for resets between the files of one
+
+    trainee.
+
+    """
+
+    invalidate_routine_metadata()
+
+    fixture = fixture_schema_name()
+
+    definitions = fixture_definitions(cursor)
+
+ 
+
+    routines = []
+
+    if not keep_routines:
+
+        cursor.execute(
+
+            "SELECT ROUTINE_TYPE, ROUTINE_NAME FROM INFORMATION_SCHEMA.ROUTINES WHERE ROUTINE_SCHEMA = %s",
+
+            (schema,)
+
+        )
+
+        routines = cursor.fetchall()
+
+ 
+
+    cursor.execute(
+
+        "SELECT TABLE_NAME, TABLE_TYPE FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = %s",
+
+        (schema,)
+
+    )
+
+    existing = cursor.fetchall()
+
+ 
+
+    def in_schema(create_sql):
+
+        return create_sql.replace(f"`{fixture}`.", f"`{schema}`.")
+
+ 
+
+    cursor.execute(f"USE `{schema}`")
+
+    cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+
+ 
+
+    try:
+
+        for routine_type, routine_name in routines:
+
+            cursor.execute(f"DROP {routine_type} IF EXISTS `{schema}`.`{routine_name}`")
+
+ 
+
+        for table_name, table_type in existing:
+
+            kind = "VIEW" if table_type == "VIEW" else "TABLE"
+
+            cursor.execute(f"DROP {kind} IF EXISTS `{schema}`.`{table_name}`")
+
+ 
+
+        # Tables first so the views have something to select from.
+
+        for table_name, create_table in definitions["tables"]:
+
+            cursor.execute(in_schema(create_table))
+
+            cursor.execute(f"INSERT INTO `{schema}`.`{table_name}` SELECT * FROM `{fixture}`.`{table_name}`")
+
+ 
+
+        for view_name, create_view in definitions["views"]:
+
+            cursor.execute(in_schema(create_view))
+
+ 
+
+        # Triggers once the rows are in, so copying the data does not fire them.
+
+        for trigger_name, create_trigger in definitions["triggers"]:
+
+            cursor.execute(in_schema(create_trigger))
+
+ 
+
+        if not keep_routines:
+
+            for routine_name, create_routine in definitions["routines"]:
+
+                cursor.execute(in_schema(create_routine))
+
+ 
+
+        cursor.execute("COMMIT")
+
+
+ 
+
+    finally:
+
+        cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+
+
+
+ 
+
+# Statements a savepoint cannot undo: DDL, anything that ends or reshapes the transaction,
+# and CALL, since a trainee procedure may commit.
+
+_NON_TRANSACTIONAL = re.compile(
+
+    r"(CREATE|DROP|ALTER|TRUNCATE|RENAME|COMMIT|ROLLBACK|BEGIN|START\s+TRANSACTION|SET\s+((SESSION|LOCAL)\s+|@@((SESSION|LOCAL)\.)?)?AUTOCOMMIT|LOCK|UNLOCK|CALL)\b",
+
+    re.IGNORECASE
+
+)
+
+ 
+
+def needs_schema_reset(content):
+
+    """Whether a graded file holds a statement that a savepoint rollback would not undo."""
+
+    return any(_NON_TRANSACTIONAL.match(statement) for statement in split_sql_statements(content))
+
+ 
+
+@contextmanager
+
+def isolate_graded_file(cursor, schema, content):
+
+    """
+
+    Undoes a graded file's changes once it has run, so nothing leaks into the
+
+    next file: a rollback to a savepoint for plain DML, or a reset of the
+
+    worker schema's tables and views when the file holds DDL, transaction
+
+    control or a CALL.
+
+    """
+
+    if schema is not None and needs_schema_reset(content):
+
+        try:
+
+            yield
+
+        finally:
+
+            METRICS.count("file_schema_resets")
+
+            reset_worker_schema(cursor, schema, keep_routines=True)
+
+        return
+
+    cursor.execute("SAVEPOINT graded_file")
+
+    try:
+
+        yield
+
+    finally:
+
+        try:
+
+            cursor.execute("ROLLBACK TO SAVEPOINT graded_file")
+
+            cursor.execute("RELEASE SAVEPOINT graded_file")
+
+            METRICS.count("file_savepoint_rollbacks")
+
+        except mysql.connector.Error as e:
+
+            # Autocommit turned on, or the savepoint committed away: only a reset undoes the file.
+
+            logging.warning(f"Could not roll back graded file changes, resetting the schema: {e}")
+
+            if schema is not None:
+
+                METRICS.count("file_schema_resets")
+
+                reset_worker_schema(cursor, schema, keep_routines=True)
+
+
+ 
+
+
+ 
+
+def read_submission_files(zip_ref, trn_id):
+
+    """
+
+    Reads the <trn_id>/MySQL/*.txt members of a submission zip into memory,
+
+    the same files extracting the zip and listing that folder would find.
+
+    """
+
+    files = {}
+
+    for member in zip_ref.infolist():
+
+        folder, _, file_name = member.filename.rpartition("/")
+
+        if folder == f"{trn_id}/MySQL" and file_name.endswith(".txt"):
+
+            files[file_name] = zip_ref.read(member).decode("utf-8", errors="replace")
+
+    return files
+
+
+ 
+
+
+ 
+
+def file_digest(path):
+
+    """SHA-256 of a file's bytes, read in chunks."""
+
+    sha = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+ 
+
+
+ 
+
+def grading_cache_key(zip_path, trn_id, test_plan):
+
+    """Cache key for one submission: its content hash under the current test plan."""
+
+    key = f"{trn_id}:{file_digest(zip_path)}:{test_plan['digest']}"
+
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+ 
+
+
+ 
+
+def load_cached_grade(key):
+
+    """Returns the stored grading entry for a cache key, or None."""
+
+    if not GRADING_CACHE_ENABLED:
+
+        return None
+
+    cache_path = os.path.join(GRADING_CACHE_DIR, f"{key}.json")
+
+    try:
+
+        with open(cache_path, 'r') as f:
+
+            return json.load(f)
+
+    except (FileNotFoundError, json.JSONDecodeError):
+
+        return None
+
+
+ 
+
+
+ 
+
+def store_cached_grade(key, entry):
+
+    """
+
+    Persists a grading entry; written to a temp file first so readers never
+
+    see half an entry. Entries that ran into a time budget are not stored.
+
+    """
+
+    if not GRADING_CACHE_ENABLED or entry.get("timed_out"):
+
+        return
+
+    os.makedirs(GRADING_CACHE_DIR, exist_ok=True)
+
+    cache_path = os.path.join(GRADING_CACHE_DIR, f"{key}.json")
+
+    with open(f"{cache_path}.tmp", 'w') as f:
+
+        json.dump(entry, f)
+
+    os.replace(f"{cache_path}.tmp", cache_path)
+
+
+ 
+
+
+ 
+
+# MySQL reserved words: they can never be unquoted names, so folding their case is safe.
+
+SQL_KEYWORDS = frozenset("""
+
+    ADD ALL ALTER ANALYZE AND AS ASC BEFORE BETWEEN BIGINT BINARY BLOB BOTH BY CALL CASCADE CASE
+
+    CHANGE CHAR CHARACTER CHECK COLLATE COLUMN CONDITION CONSTRAINT CONTINUE CONVERT CREATE CROSS
+
+    CUME_DIST CURRENT_DATE CURRENT_TIME CURRENT_TIMESTAMP CURRENT_USER CURSOR DATABASE DECIMAL
+
+    DECLARE DEFAULT DELETE DENSE_RANK DESC DESCRIBE DETERMINISTIC DISTINCT DIV DOUBLE DROP EACH
+
+    ELSE ELSEIF EXCEPT EXISTS EXIT EXPLAIN FALSE FETCH FIRST_VALUE FLOAT FOR FORCE FOREIGN FROM
+
+    FULLTEXT FUNCTION GRANT GROUP GROUPING GROUPS HAVING IF IGNORE IN INDEX INNER INOUT INSERT INT
+
+    INTEGER INTERSECT INTERVAL INTO IS ITERATE JOIN KEY KEYS KILL LAG LAST_VALUE LATERAL LEAD
+
+    LEADING LEAVE LEFT LIKE LIMIT LOCALTIME LOCALTIMESTAMP LOCK LOOP MATCH MEDIUMINT MOD MODIFIES
+
+    NATURAL NOT NTH_VALUE NTILE NULL NUMERIC OF ON OPTION OR ORDER OUT OUTER OVER PARTITION
+
+    PERCENT_RANK PRIMARY PROCEDURE RANGE RANK READ READS REAL RECURSIVE REFERENCES REGEXP RELEASE
+
+    RENAME REPEAT REPLACE RESIGNAL RESTRICT RETURN REVOKE RIGHT RLIKE ROW ROWS ROW_NUMBER SCHEMA
+
+    SELECT SET SHOW SIGNAL SMALLINT SQL SQLEXCEPTION SQLSTATE SQLWARNING STRAIGHT_JOIN TABLE THEN
+
+    TINYINT TO TRAILING TRIGGER TRUE UNDO UNION UNIQUE UNLOCK UNSIGNED UPDATE USE USING UTC_DATE
+
+    UTC_TIME UTC_TIMESTAMP VALUES VARCHAR VARYING WHEN WHERE WHILE WINDOW WITH WRITE XOR
+
+""".split())
+
+_NORMALIZE_TOKEN = re.compile(
+
+    r"(?P<comment>--(?=\s|$)[^\n]*|#[^\n]*|/\*(?!!).*?\*/)"
+
+    r"|(?P<quoted>'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`(?:[^`]|``)*`)"
+
+    r"|(?P<word>[\w$@]+)"
+
+    r"|(?P<space>\s+)"
+
+    r"|(?P<other>.)",
+
+    re.DOTALL
+
+)
+
+ 
+
+def normalize_sql(source):
+
+    """
+
+    A file's statements with comments dropped, each run of whitespace made one
+
+    space and reserved words in upper case, so SQL-equivalent files normalize
+
+    alike. Names, literals and quoted names are left exactly as written.
+
+    """
+
+    normalized = []
+
+    for statement in split_sql_statements(source):
+
+        parts = []
+
+        spaced = False
+
+        previous = None
+
+        for match in _NORMALIZE_TOKEN.finditer(statement):
+
+            kind, text = match.lastgroup, match.group()
+
+            if kind in ("comment", "space"):
+
+                spaced = bool(parts)
+
+                continue
+
+            if spaced:
+
+                parts.append(" ")
+
+                spaced = False
+
+            # After a dot a reserved word is a qualified name, e.g. emp.order.
+
+            if kind == "word" and previous != "." and text.upper() in SQL_KEYWORDS:
+
+                text = text.upper()
+
+            parts.append(text)
+
+            previous = text
+
+        if parts:
+
+            normalized.append("".join(parts))
+
+    return normalized
+
+ 
+
+def sql_fingerprint(source):
+
+    """SHA-256 of a file's normalized statements, or None when there is no file."""
+
+    if source is None:
+
+        return None
+
+    return hashlib.sha256("\n".join(normalize_sql(source)).encode("utf-8")).hexdigest()
+
+ 
+
+ 
+
+# Statements that leave state behind for the next file even after its isolation:
+
+# schema changes, plus session settings and variables and prepared statements.
+
+_SESSION_COMMANDS = ("SET", "PREPARE", "EXECUTE", "DEALLOCATE")
+
+ 
+
+def code_tokens(statement):
+
+    """A statement's (kind, text) tokens without comments and whitespace."""
+
+    return [
+
+        (match.lastgroup, match.group()) for match in _NORMALIZE_TOKEN.finditer(statement)
+
+        if match.lastgroup not in ("comment", "space")
+
+    ]
+
+ 
+
+def changes_session(statement):
+
+    """Whether a statement sets session state: a leading SET or PREPARE, or a user variable outside literals."""
+
+    tokens = code_tokens(statement)
+
+    if tokens and tokens[0][0] == "word" and tokens[0][1].upper() in _SESSION_COMMANDS:
+
+        return True
+
+    return any(kind == "word" and "@" in text for kind, text in tokens)
+
+ 
+
+def carries_session_state(content):
+
+    """Whether a query file can change what the files after it see."""
+
+    return needs_schema_reset(content) or any(changes_session(statement) for statement in split_sql_statements(content))
+
+ 
+
+
+ 
+
+# Deterministic built-in functions a cacheable SELECT may call; any other call could be
+
+# a trainee routine, whose result or side effects the cache cannot vouch for.
+
+SQL_FUNCTIONS = frozenset("""
+
+    ABS ACOS ADDDATE ASCII ASIN ATAN AVG CAST CEIL CEILING CHARACTER_LENGTH CHAR_LENGTH COALESCE
+
+    CONCAT CONCAT_WS CONVERT COS COUNT CUME_DIST DATE DATEDIFF DATE_ADD DATE_FORMAT DATE_SUB DAY
+
+    DAYNAME DAYOFMONTH DAYOFWEEK DAYOFYEAR DEGREES EXP EXTRACT FIELD FIND_IN_SET FIRST_VALUE
+
+    FLOOR FORMAT GREATEST GROUP_CONCAT HEX HOUR IFNULL INSTR ISNULL LAG LAST_DAY LAST_VALUE
+
+    LCASE LEAD LEAST LENGTH LN LOCATE LOG LOG10 LOG2 LOWER LPAD LTRIM MAX MID MIN MINUTE MOD
+
+    MONTH MONTHNAME NTH_VALUE NTILE NULLIF PERCENT_RANK PI POSITION POW POWER QUARTER RADIANS
+
+    REVERSE ROUND RPAD RTRIM SECOND SIGN SIN SPACE SQRT STD STDDEV STRCMP STR_TO_DATE SUBDATE
+
+    SUBSTR SUBSTRING SUBSTRING_INDEX SUM TAN TIME TIMEDIFF TIMESTAMP TIMESTAMPADD TIMESTAMPDIFF
+
+    TIME_FORMAT TRIM TRUNCATE UCASE UPPER VARIANCE VAR_POP VAR_SAMP WEEK WEEKDAY YEAR YEARWEEK
+
+""".split())
+
+
+# Words that make a SELECT write, lock, or depend on the clock, session or connection.
+
+_UNCACHEABLE_WORDS = frozenset("""
+
+    INTO UPDATE DELETE INSERT SHARE LOCK NOW CURDATE CURTIME CURRENT_DATE CURRENT_TIME
+
+    CURRENT_TIMESTAMP LOCALTIME LOCALTIMESTAMP SYSDATE UNIX_TIMESTAMP UTC_DATE UTC_TIME
+
+    UTC_TIMESTAMP RAND UUID UUID_SHORT CONNECTION_ID DATABASE SCHEMA USER CURRENT_USER
+
+    SESSION_USER SYSTEM_USER LAST_INSERT_ID FOUND_ROWS ROW_COUNT SLEEP BENCHMARK GET_LOCK
+
+    VERSION INFORMATION_SCHEMA PERFORMANCE_SCHEMA
+
+""".split())
+
+ 
+
+def is_read_only(statement):
+
+    """
+
+    Whether a statement only reads table data and returns the same rows for
+
+    the same data: a SELECT or WITH ... SELECT without INTO, locking clauses,
+
+    user variables, or calls to anything but deterministic built-ins.
+
+    """
+
+    tokens = code_tokens(statement)
+
+    words = [text.upper() for kind, text in tokens if kind == "word"]
+
+    if not words or words[0] not in ("SELECT", "WITH"):
+
+        return False
+
+    for index, (kind, text) in enumerate(tokens):
+
+        calls = index + 1 < len(tokens) and tokens[index + 1] == ("other", "(")
+
+        if kind == "quoted" and calls:
+
+            return False
+
+        if kind != "word":
+
+            continue
+
+        word = text.upper()
+
+        if word in _UNCACHEABLE_WORDS or "@" in word:
+
+            return False
+
+        if calls and word not in SQL_KEYWORDS and word not in SQL_FUNCTIONS:
+
+            return False
+
+    return True
+
+ 
+
+ 
+
+def result_state(test_plan, *fingerprints):
+
+    """
+
+    The data state a query file starts from: the fixture digest plus the
+
+    fingerprints of the earlier files that may have changed it. None with the result
+
+    cache turned off.
+
+    """
+
+    if RESULT_CACHE_ENTRIES <= 0:
+
+        return None
+
+    parts = [test_plan["fixture_digest"]] + [fingerprint or "-" for fingerprint in fingerprints]
+
+    return hashlib.sha256(":".join(parts).encode("utf-8")).hexdigest()
+
+ 
+
+ 
+
+class ResultCache:
+
+    """
+
+    Result lines of read-only SELECTs, keyed by the data state they ran on
+
+    and their normalized SQL, least recently used dropped first once the
+
+    entry or byte budget is exceeded. Any other statement moves its file on
+
+    to a new state (see advance), so rows read after DML or DDL are never
+
+    served from a key taken before it.
+
+    """
+
+ 
+
+    def __init__(self, max_entries=RESULT_CACHE_ENTRIES, max_rows=RESULT_CACHE_ROWS, max_bytes=RESULT_CACHE_BYTES):
+
+        self.max_entries = max_entries
+
+        self.max_rows = max_rows
+
+        self.max_bytes = max_bytes
+
+        self.entries = OrderedDict()
+
+        self.size = 0
+
+        self._lock = threading.Lock()
+
+ 
+
+    def key(self, state, statement):
+
+        normalized = "\n".join(normalize_sql((statement,)))
+
+        return hashlib.sha256(f"{state}:{normalized}".encode("utf-8")).hexdigest()
+
+ 
+
+    def advance(self, state, statement):
+
+        """The state after a statement that may have changed data ran on state."""
+
+        return self.key(state, statement)
+
+ 
+
+    def get(self, key):
+
+        with self._lock:
+
+            entry = self.entries.get(key)
+
+            if entry is None:
+
+                return None
+
+            self.entries.move_to_end(key)
+
+            return entry[0]
+
+ 
+
+    def put(self, key, lines):
+
+        if len(lines) > self.max_rows or self.max_entries <= 0:
+
+            return
+
+        # Row text plus a rough per-line overhead for the str objects themselves.
+
+        size = sum(len(line) + 64 for line in lines)
+
+        if size > self.max_bytes:
+
+            return
+
+        with self._lock:
+
+            previous = self.entries.pop(key, None)
+
+            if previous is not None:
+
+                self.size -= previous[1]
+
+            self.entries[key] = (tuple(lines), size)
+
+            self.size += size
+
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+ 
+
+
+ 
+
+RESULT_CACHE = ResultCache()
+
+
+ 
+
+
+ 
+
+# Recorded file outcomes by key for this run, shared by every grading worker.
+
+FILE_OUTCOMES = {}
+
+
+_file_outcomes_lock = threading.Lock()
+
+ 
+
+def file_outcome_key(test_plan, file_name, fingerprint, *depends_on):
+
+    """
+
+    Key for one graded file: the test plan digest (which covers the fixture),
+
+    the file's name and fingerprint, and the fingerprints of the files whose
+
+    effects it runs on. None when there is no file to deduplicate.
+
+    """
+
+    if not DEDUP_FILES or fingerprint is None:
+
+        return None
+
+    parts = [test_plan["digest"], file_name, fingerprint] + [depend or "-" for depend in depends_on]
+
+    return hashlib.sha256(":".join(parts).encode("utf-8")).hexdigest()
+
+ 
+
+def replay_statements(cursor, content):
+
+    """Re-runs a file's statements for their side effects only, stopping at the first error."""
+
+    try:
+
+        for statement in split_sql_statements(content):
+
+            if statement.strip():
+
+                execute_statement(cursor, statement, fetch=False)
+
+    except Exception as e:
+
+        logging.info(f"Replay stopped: {e}")
+
+ 
+
+def run_deduplicated(key, entry, log_file, grade, replay=None):
+
+    """
+
+    Runs grade() for one file and records what it added to the entry: its log
+
+    section, scores and tests. When key already has a recorded outcome, that
+
+    outcome is copied in instead, after replay() has re-created anything the
+
+    later files rely on. Outcomes that ran into a time budget are not recorded,
+
+    since they depend on load rather than on the SQL.
+
+    """
+
+    METRICS.count("files_graded")
+
+    if key is not None:
+
+        with _file_outcomes_lock:
+
+            recorded = FILE_OUTCOMES.get(key)
+
+        if recorded is not None:
+
+            if replay is not None:
+
+                replay()
+
+            log_file.write(recorded["log"])
+
+            entry["scores"].update(recorded["scores"])
+
+            entry["tests"].extend(dict(test) for test in recorded["tests"])
+
+            METRICS.count("files_deduplicated")
+
+            return
+
+    log_start = log_file.tell()
+
+    scores_before = set(entry["scores"])
+
+    tests_before = len(entry["tests"])
+
+    timeouts_before = getattr(_grading_budget, "timeouts", 0)
+
+    grade()
+
+    if key is None or getattr(_grading_budget, "timeouts", 0) != timeouts_before:
+
+        return
+
+    recorded = {
+
+        "log": log_file.getvalue()[log_start:],
+
+        "scores": {name: marks for name, marks in entry["scores"].items() if name not in scores_before},
+
+        "tests": [dict(test) for test in entry["tests"][tests_before:]]
+
+    }
+
+    with _file_outcomes_lock:
+
+        FILE_OUTCOMES.setdefault(key, recorded)
+
+
+ 
+
+
+ 
+
+def decode_submission(zip_path, trn_id, extract=EXTRACT_SUBMISSIONS):
+
+    """
+
+    The CPU side of grading one zip: reads its files and splits each query
+
+    file into a tuple of statements, so the executing worker only talks to
+
+    MySQL. fun.txt and proc.txt stay text for the routine checks.
+
+    """
+
+    started = time.perf_counter()
+
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+
+        files = read_submission_files(zip_ref, trn_id)
+
+        if extract:
+
+            extract_path = os.path.join(SUBMISSION_PATH, f"unzipped_{trn_id}")
+
+            os.makedirs(extract_path, exist_ok=True)
+
+            zip_ref.extractall(extract_path)
+
+    for name, content in files.items():
+
+        if name not in ["fun.txt", "proc.txt"]:
+
+            files[name] = tuple(split_sql_statements(content))
+
+    METRICS.record_phase("decode", started, trn_id)
+
+    return files
+
+ 
+
+
+ 
+
+def grade_trainee(cursor, zip_path, trn_id, solutions_dir, test_plan, extract=EXTRACT_SUBMISSIONS, schema=None, files=None):
+
+    """
+
+    Grades one trainee zip. Returns the trainee's entry: its log section as
+
+    text, the marks per query file, function and procedure section, and one
+
+    record per test for the results store, plus whether any statement timed
+
+    out. With the worker schema given, each query file's changes are undone
+
+    before the next one runs. files, from decode_submission, saves reading
+
+    the zip again.
+
+    """
+
+    log_file = io.StringIO()
+
+    entry = {"trn_id": trn_id, "log": None, "scores": {}, "tests": []}
+
+
+ 
+
+    log_with_indent(log_file, f"{trn_id}:", 0)
+
+
+ 
+
+    trainee_started = time.perf_counter()
+
+    if files is None:
+
+        files = decode_submission(zip_path, trn_id, extract)
+
+
+ 
+
+    trn_solution_path = os.path.join(solutions_dir, trn_id)
+
+    os.makedirs(trn_solution_path, exist_ok=True)
+
+
+ 
+
+    # Every statement below runs under the per-statement and per-trainee time budgets.
+
+    timeouts_before = getattr(_grading_budget, "timeouts", 0)
+
+    with grading_budget(cursor), confined_to_schema(cursor, schema or DB_CONFIG["database"]):
+
+        # Files whose normalized SQL was already graded under this plan reuse that outcome.
+
+        fun_print = sql_fingerprint(files.get("fun.txt"))
+
+        proc_print = sql_fingerprint(files.get("proc.txt"))
+
+ 
+
+        log_with_indent(log_file, "function:", 1)
+
+        started = time.perf_counter()
+
+        def grade_functions():
+
+            try:
+
+                fun_log = run_trainee_functions(cursor, files.get("fun.txt"), trn_id, test_plan, entry)
+
+                log_with_indent(log_file, fun_log, 2)
+
+            except Exception as e:
+
+                log_with_indent(log_file, f"Error: {e}", 2)
+
+        run_deduplicated(
+
+            file_outcome_key(test_plan, "fun.txt", fun_print), entry, log_file, grade_functions,
+
+            replay=lambda: replay_statements(cursor, files.get("fun.txt"))
+
+        )
+
+        METRICS.record_phase("functions", started, trn_id)
+
+
+ 
+        log_with_indent(log_file, "procedure:", 1)
+
+        started = time.perf_counter()
+
+        def grade_procedures():
+
+            try:
+
+                proc_log = run_trainee_procedures(cursor, files.get("proc.txt"), trn_id, test_plan, entry)
+
+                log_with_indent(log_file, proc_log, 2)
+
+            except Exception as e:
+
+                log_with_indent(log_file, f"Error: {e}", 2)
+
+        # A procedure may call the trainee's function, so its outcome depends on fun.txt too.
+
+        run_deduplicated(
+
+            file_outcome_key(test_plan, "proc.txt", proc_print, fun_print), entry, log_file, grade_procedures,
+
+            replay=lambda: replay_statements(cursor, files.get("proc.txt"))
+
+        )
+
+        METRICS.record_phase("procedures", started, trn_id)
+
+
+ 
+        started = time.perf_counter()
+
+        # A tested procedure may have committed changes, so the query files start again from
+
+        # the fixture's tables, keeping the trainee's routines for them to call.
+
+        from_fixture = schema is not None
+
+        if from_fixture:
+
+            try:
+
+                reset_worker_schema(cursor, schema, keep_routines=True)
+
+            except Exception as e:
+
+                from_fixture = False
+
+                log_with_indent(log_file, f"Error resetting the worker schema: {e}", 1)
+
+        # Files that leave state behind always run, and feed the keys of the files after them.
+
+        # Read-only results are shared on the worker schema, whose tables now hold the fixture;
+
+        # calls to the trainee's routines are never cached, so fun.txt and proc.txt do not count.
+
+        state_prints = []
+
+        for query_file, content in files.items():
+
+            if query_file not in ["fun.txt", "proc.txt"]:
+
+                file_print = sql_fingerprint(content)
+
+                state = result_state(test_plan, *state_prints) if from_fixture else None
+
+                key = None
+
+                if carries_session_state(content):
+
+                    state_prints.append(file_print)
+
+                else:
+
+                    key = file_outcome_key(test_plan, query_file, file_print, fun_print, proc_print, *state_prints)
+
+                def grade_query_file():
+
+                    try:
+
+                        log_file.write(f"{query_file}:\n")
+
+                        with isolate_graded_file(cursor, schema, content):
+
+                            execute_commands(query_file, cursor, log_file, is_author=False, trn_id=trn_id, content=content, test_plan=test_plan, outcome=entry, state=state)
+
+                    except Exception as e:
+
+                        print(e)
+
+                run_deduplicated(key, entry, log_file, grade_query_file)
+
+        METRICS.record_phase("queries", started, trn_id)
+
+
+ 
+
+    # A timeout can mean no more than a busy server, so the entry must not be cached.
+
+    entry["timed_out"] = getattr(_grading_budget, "timeouts", 0) != timeouts_before
+
+    log_with_indent(log_file, "", 0)
+
+    METRICS.record_phase("trainee", trainee_started, trn_id)
+
+    METRICS.count("trainees_graded")
+
+
+ 
+
+    entry["log"] = log_file.getvalue()
+
+    return entry
+
+
+ 
+
+
+ 
+
+def open_worker_connections(workers):
+
+    """
+
+    Checks out one pooled connection per grading worker. A pool holds at most
+
+    CNX_POOL_MAXSIZE connections, so beyond that every worker opens its own.
+
+    """
+
+    if workers > mysql.connector.pooling.CNX_POOL_MAXSIZE:
+
+        logging.info(f"{workers} workers exceed the connection pool size, opening plain connections")
+
+        return [mysql.connector.connect(**DB_CONFIG) for _ in range(workers)]
+
+    pool = mysql.connector.pooling.MySQLConnectionPool(
+
+        pool_name="grading_workers",
+
+        pool_size=workers,
+
+        **DB_CONFIG
+
+    )
+
+    return [pool.get_connection() for _ in range(workers)]
+
+
+
+ 
+
+def author_stage_inputs():
 
-            output_lines.append("  Parameters: Passed")
+    """Input files of each author stage; a stage only re-runs when one of them changes."""
 
-            output_lines.append(f"  marks: {param_marks}")
+    queries_dir = f'{AUTHOR_PATH}/queries'
 
-            total_marks += param_marks
+    queries = sorted(
 
-        else:
+        os.path.join(queries_dir, query_file)
 
-            output_lines.append("  Parameters: Failed")
+        for query_file in os.listdir(queries_dir) if query_file.endswith(".txt")
 
-            output_lines.append(f"    Expected: {expected_normalized}")
+    )
 
-            output_lines.append(f"    Actual:   {actual_normalized}")
+    testcases = f"{AUTHOR_PATH}/Testcases/testcases.xlsx"
+
+    sample_db = f"{AUTHOR_PATH}/sample_db.txt"
 
 
  
 
-        for idx, case in enumerate(test_cases, 1):
+    return {
 
-            output_lines.append(f"\nTestcase {idx}:")
+        "testcases": [testcases],
 
-            proc_call = case["procedure_call"]
+        "author_queries": [sample_db] + queries,
+
+        "expected_outputs": [testcases, sample_db] + queries,
+
+        "fixture": [sample_db]
+
+    }
 
 
  
 
-            try:
 
-                cursor.execute("START TRANSACTION")
+ 
+
+def author_stage_digest(paths):
+
+    """Content hash over a stage's input files (names included, so added or removed files count)."""
 
-                cursor.execute(proc_call)
+    sha = hashlib.sha256()
 
-                rows = cursor.fetchall()
+    for path in paths:
 
-                actual = normalize_result(rows)
+        sha.update(os.path.basename(path).encode("utf-8"))
+
+        sha.update(file_digest(path).encode("utf-8"))
+
+    return sha.hexdigest()
 
 
  
 
-                expected = case.get("Expected")
 
-                status = "Passed" if actual == expected else "Failed"
+ 
 
-                marks_awarded = case.get("marks", 0) if status == "Passed" else 0
+def load_author_manifest():
 
-                total_marks += marks_awarded
+    try:
 
-                output_lines.append(f"  Status: {status}")
+        with open(f"{AUTHOR_PATH}/.author_manifest.json", 'r') as f:
 
-                output_lines.append(f"  marks: {marks_awarded}")
+            return json.load(f)
 
-                if status == "Failed":
+    except (FileNotFoundError, json.JSONDecodeError):
 
-                    output_lines.append(f"    Procedure Call: {proc_call}")
+        return {}
 
-                    output_lines.append(f"    Expected: {expected}")
 
-                    output_lines.append(f"    Actual:   {actual}")
+ 
 
 
  
 
-            except Exception as e:
+def save_author_manifest(manifest):
 
-                cursor.execute("ROLLBACK")
+    with open(f"{AUTHOR_PATH}/.author_manifest.json", 'w') as f:
 
-                output_lines.append("  Status: Failed")
+        json.dump(manifest, f, indent=4)
 
-                output_lines.append(f"    Procedure Call: {proc_call}")
 
-                output_lines.append(f"    Error: {e}")
+ 
 
-                continue
+
+ 
+
+def run_author_stage(name, stage, outputs_present=lambda: True, force=False):
+
+    """
+
+    Runs one author stage unless its inputs hash to the value recorded in the
+
+    manifest and its outputs are still there. Returns True if the stage ran.
+
+    """
+
+    manifest = load_author_manifest()
+
+    digest = author_stage_digest(author_stage_inputs()[name])
 
 
  
 
-            if "checks" in case:
+    if not (force or FORCE_AUTHOR_STAGES) and manifest.get(name) == digest and outputs_present():
 
-                output_lines.append("  Checks:")
+        logging.info(f"Author stage '{name}' unchanged, skipped.")
 
-                for check_idx, check in enumerate(case["checks"], 1):
+        print(f"Author stage '{name}' unchanged, skipped.")
 
-                    try:
+        return False
 
-                        cursor.execute(check["query"])
 
-                        rows = cursor.fetchall()
+ 
 
-                        check_actual = normalize_result(rows)
+    stage()
 
-                        check_expected = check.get("Expected")
 
-                        check_status = "Passed" if check_actual == check_expected else "Failed"
+ 
 
-                        marks_awarded = check.get("marks", 0) if check_status == "Passed" else 0
+    manifest[name] = digest
 
-                        total_marks += marks_awarded
+    save_author_manifest(manifest)
+
+    return True
 
 
  
 
-                        output_lines.append(f"    Check {check_idx}: {check_status}")
 
-                        output_lines.append(f"    marks: {marks_awarded}")
+ 
 
-                        if check_status == "Failed":
+def prepare_author_artifacts(cursor):
 
-                            output_lines.append(f"      Query: {check['query']}")
+    """Builds the testcase JSON, author outputs and expected results, skipping unchanged stages."""
+
+    testcase_files = [
 
-                            output_lines.append(f"      Expected: {check_expected}")
+        f'{AUTHOR_PATH}/Testcases/fun_testcases.json',
 
-                            output_lines.append(f"      Actual:   {check_actual}")
+        f'{AUTHOR_PATH}/Testcases/proc_testcases.json'
+
+    ]
 
 
  
 
-                    except Exception as e:
+    def author_outputs_present():
 
-                        output_lines.append(f"    Check {check_idx}: Failed")
+        queries = author_stage_inputs()["author_queries"][1:]
 
-                        output_lines.append(f"      Query: {check['query']}")
+        return all(
 
-                        output_lines.append(f"      Error: {e}")
+            os.path.exists(os.path.join(f"{AUTHOR_PATH}/output", os.path.basename(path)))
+
+            for path in queries
+
+        )
 
 
  
 
-        cursor.execute("ROLLBACK")
+    ran_testcases = run_author_stage(
 
-        output_lines.append(f"\nTotal marks for procedures: {total_marks}")
+        "testcases",
 
-        return "\n".join(output_lines)
+        write_to_json,
+
+        lambda: all(os.path.exists(path) for path in testcase_files)
+
+    )
 
 
  
 
-    except Exception as e:
+    # Author query files run on a clone of the fixture, so it has to exist first.
 
-        return f"Error executing procedures: {e}"
+    ensure_fixture_schema(cursor)
+
+    ran_queries = run_author_stage(
+
+        "author_queries",
+
+        lambda: execute_author_queries(cursor),
+
+        author_outputs_present
+
+    )
 
 
  
 
-def run_trainee_functions(cursor, mysql_path, trn_id):
+    # Expected results are computed from the testcase JSON in the clone the author
+
+    # query files ran in, so they must be redone whenever either of those was rebuilt.
+
+    def generate_expected():
+
+        schema = author_schema_name()
+
+        cursor.execute(
+
+            "SELECT COUNT(*) FROM INFORMATION_SCHEMA.SCHEMATA WHERE SCHEMA_NAME = %s",
+
+            (schema,)
 
-    import os, json, sqlparse, re
+        )
+
+        # The author's routines only exist there, so a missing clone means running the files again.
+
+        if cursor.fetchone()[0] == 0:
+
+            execute_author_queries(cursor)
+
+        use_worker_schema(cursor, schema)
+
+        try:
+
+            with confined_to_schema(cursor, schema):
+
+                generate_expected_output(cursor)
+
+                generate_procedure_test(cursor)
+
+        finally:
+
+            cursor.execute(f"USE `{DB_CONFIG['database']}`")
 
 
  
 
-    fun_path = os.path.join(mysql_path, "fun.txt")
+    run_author_stage(
 
-    if not os.path.exists(fun_path):
+        "expected_outputs",
 
-        return "execute successfully"
+        generate_expected,
+
+        lambda: all(os.path.exists(path) for path in testcase_files),
+
+        force=ran_testcases or ran_queries
+
+    )
 
 
  
 
-    output_lines = []
 
-    total_marks = 0
+ 
+
+def ensure_fixture_schema(cursor):
+
+    """Rebuilds the fixture schema only when sample_db.txt changed or the schema is missing."""
+
+    def fixture_present():
+
+        cursor.execute(
+
+            "SELECT COUNT(*) FROM INFORMATION_SCHEMA.SCHEMATA WHERE SCHEMA_NAME = %s",
+
+            (fixture_schema_name(),)
+
+        )
+
+        return cursor.fetchone()[0] > 0
+
+
+ 
+
+    run_author_stage("fixture", lambda: build_fixture_schema(cursor), fixture_present)
+
+
+ 
+
+
+ 
+
+def execute_submissions(cursor, test_plan, workers=GRADING_WORKERS, decoders=DECODE_WORKERS):
+
+   """
+
+   Grades every submission zip through a three-stage pipeline joined by
+
+   bounded queues, so no stage waits for the others' work:
+
+     decode  - `decoders` threads hash each zip for the grading cache, then
+
+               unzip and split it (decode_submission); cache hits skip ahead;
+
+     execute - `workers` threads, each owning one connection and worker schema,
+
+               reset the schema and run the trainee's SQL (grade_trainee);
+
+     write   - this thread stores cache entries and writes the log, the
+
+               scoreboard and the results store in submission order.
+
+   Result comparison stays in the execute stage: rows are hashed as they
+
+   stream in, so there is no result set to hand to a later stage.
+
+   """
+
+   solutions_dir = "Solutions"
+
+   os.makedirs(solutions_dir, exist_ok=True)
+
+   log_dir = "logfile"
+
+   os.makedirs(log_dir, exist_ok=True)
+
+   log_path = os.path.join(log_dir, "execution.log")
+
+   submissions = [file for file in os.listdir(SUBMISSION_PATH) if file.endswith(".zip")]
+
+ 
+
+   # Trainees never run in the author database: every worker gets its own clone
+
+   # of the sample_db.txt state, reset before each trainee, so routine names and
+
+   # DML cannot collide between workers or leak from one trainee to the next.
+
+   ensure_fixture_schema(cursor)
+
+ 
+
+   # Every worker gets a connection of its own (see open_worker_connections), so its session can be
+
+   # reset between trainees without touching the main connection.
+
+   workers = max(1, workers)
+
+   connections = open_worker_connections(workers)
+
+   slots = []
+
+   for index in range(workers):
+
+       cur = connections[index].cursor()
+
+       schema = worker_schema_name(index)
+
+       use_worker_schema(cur, schema)
+
+       slots.append((connections[index], cur, schema))
+
+ 
+
+   pending = queue.Queue()
+
+   for seq, file in enumerate(submissions):
+
+       pending.put((seq, file))
+
+   decoded = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+   graded = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+ 
+
+   def failed_entry(trn_id, e):
+
+       logging.error(f"Error grading {trn_id}: {e}")
+
+       entry = {"trn_id": trn_id, "log": f"{trn_id}:\n  Error: {e}\n\n", "scores": {}, "tests": []}
+
+       record_test(entry, "grading:error", "Failed", error=str(e))
+
+       return entry
+
+ 
+
+   def decode_stage():
+
+       while True:
+
+           try:
+
+               seq, file = pending.get_nowait()
+
+           except queue.Empty:
+
+               return
+
+           trn_id = os.path.splitext(file)[0]
+
+           zip_path = os.path.join(SUBMISSION_PATH, file)
+
+           key = None
+
+           try:
+
+               # Unchanged submissions under an unchanged test plan reuse their stored entry.
+
+               key = grading_cache_key(zip_path, trn_id, test_plan)
+
+               entry = load_cached_grade(key)
+
+               if entry is not None:
+
+                   METRICS.count("cache_hits")
+
+                   graded.put((seq, entry, None))
+
+                   continue
+
+               decoded.put((seq, trn_id, zip_path, key, decode_submission(zip_path, trn_id)))
+
+           except Exception as e:
+
+               graded.put((seq, failed_entry(trn_id, e), None))
+
+ 
+
+   def execute_stage(con, cur, schema):
+
+       while True:
+
+           started = time.perf_counter()
+
+           job = decoded.get()
+
+           TRACER.record("wait_submission", started, "phase")
+
+           if job is None:
+
+               return
+
+           seq, trn_id, zip_path, key, files = job
+
+           try:
+
+               started = time.perf_counter()
+
+               reset_session(con, cur, schema)
+
+               reset_worker_schema(cur, schema)
+
+               METRICS.record_phase("reset", started, trn_id)
+
+               entry = grade_trainee(cur, zip_path, trn_id, solutions_dir, test_plan, schema=schema, files=files)
+
+           except Exception as e:
+
+               entry, key = failed_entry(trn_id, e), None
+
+           finally:
+
+               # Commit per trainee so row locks are not held against other workers.
+
+               try:
+
+                   cur.execute("COMMIT")
+
+               except mysql.connector.Error as e:
+
+                   logging.error(f"Commit after {trn_id} failed: {e}")
+
+           graded.put((seq, entry, key))
+
+ 
+
+   def close_execute_stage(decode_threads):
+
+       for thread in decode_threads:
+
+           thread.join()
+
+       for _ in slots:
+
+           decoded.put(None)
+
+ 
+
+   scoreboard = ScoreboardWriter(SCOREBOARD_PATH, test_plan["author_outputs"].keys())
+
+   store = open_results_store()
+
+ 
+
+   decode_threads = [
+
+       threading.Thread(target=decode_stage, name=f"grading-decode-{index}", daemon=True)
+
+       for index in range(max(1, decoders))
+
+   ]
+
+   execute_threads = [
 
-    try:
+       threading.Thread(target=execute_stage, args=slot, name=f"grading-worker-{index}", daemon=True)
 
-        with open(f'{AUTHOR_PATH}/Testcases/fun_testcases.json', 'r') as f:
+       for index, slot in enumerate(slots)
 
-            json_data = json.load(f)
+   ]
 
+   closer = threading.Thread(target=close_execute_stage, args=(decode_threads,), name="grading-decode-close", daemon=True)
 
  
 
-        meta_data = json_data.get("meta_data", {})
+   try:
 
-        test_cases = json_data.get("tests", [])
+       with open(log_path, 'w') as log_file, scoreboard, closing(store):
 
+           for thread in decode_threads + execute_threads + [closer]:
 
- 
+               thread.start()
 
-        with open(fun_path, 'r') as f_fun:
+ 
 
-            content = f_fun.read()
+           # Write stage: entries arrive in any order and leave in submission order.
 
+           waiting = {}
 
- 
+           next_seq = 0
 
-        statements = sqlparse.split(content)
+           while next_seq < len(submissions):
 
-        for statement in statements:
+               seq, entry, key = graded.get()
 
-            if statement.strip():
+               waiting[seq] = (entry, key)
 
-                cursor.execute(statement)
+               while next_seq in waiting:
 
+                   entry, key = waiting.pop(next_seq)
 
- 
+                   started = time.perf_counter()
 
-        output_lines.append("\nMetadata Checks:")
+                   if key is not None:
 
+                       store_cached_grade(key, entry)
 
- 
+                   log_file.write(entry["log"])
 
-        routine_type, routine_name = get_routine_type_and_name(content)
+                   log_file.flush()
 
-        cursor.execute("SELECT DATABASE();")
+                   scoreboard.append(entry["trn_id"], entry["scores"])
 
-        db_name = cursor.fetchone()[0]
+                   save_trainee_results(store, entry)
 
-        params = write_parameters_to_file(cursor, db_name, routine_name, "param_output_file", is_author=False)
+                   METRICS.record_phase("write_results", started, entry["trn_id"])
 
+                   next_seq += 1
 
  
 
-        def normalize_param(p):
+       for thread in execute_threads:
 
-            return {
+           thread.join()
 
-                "mode": p["mode"].upper() if p["mode"] else "IN",
+   finally:
 
-                "name": p["name"].lower() if p["name"] else None,
+       for con in connections:
 
-                "type": p["type"].lower()
+           con.close()
 
-            }
+ 
 
 
  
 
-        expected_routine_name = meta_data.get("routine_name")
+def compare_outputs(author_index=None):
 
-        name_marks = meta_data.get("routine_name_marks", 0)
+    return dict(iter_compare_outputs(author_index))
 
-        if routine_name == expected_routine_name:
 
-            output_lines.append("  Routine Name: Passed")
+ 
 
-            output_lines.append(f"  marks: {name_marks}")
 
-            total_marks += name_marks
+ 
 
-        else:
+def iter_compare_outputs(author_index=None):
 
-            output_lines.append("  Routine Name: Failed")
+    """Yields (trn_id, {query_file: 0/1}) one trainee at a time."""
 
-            output_lines.append(f"    Expected: {expected_routine_name}")
+    if author_index is None:
 
-            output_lines.append(f"    Actual:   {routine_name}")
+        author_index = build_author_output_index()
+
+    solution_dir = "Solutions"
 
 
  
 
-        expected_type = meta_data.get("routine_type")
+    for trn_id in os.listdir(solution_dir):
 
-        type_marks = meta_data.get("routine_type_marks", 0)
+       
 
-        if routine_type.upper() == expected_type.upper():
+        trn_path = os.path.join(solution_dir, trn_id)
 
-            output_lines.append("  Routine Type: Passed")
+        comparison = {}
 
-            output_lines.append(f"  marks: {type_marks}")
 
-            total_marks += type_marks
+ 
 
-        else:
+        for query_file in os.listdir(trn_path):
 
-            output_lines.append("  Routine Type: Failed")
+            if query_file == "fun_output.json" or query_file == "proc_output.json":
 
-            output_lines.append(f"    Expected: {expected_type}")
+                continue
 
-            output_lines.append(f"    Actual:   {routine_type}")
+            sub_file = os.path.join(trn_path, query_file)
+
+            author_output = author_index.get(query_file)
 
 
  
 
-        expected_params = meta_data.get("parameters", [])
+            is_same = author_output is not None and result_digest(read_output_rows(sub_file)) == author_output["digest"]
 
-        param_marks = meta_data.get("parameters_marks", 0)
+            comparison[query_file] = int(is_same)
 
 
  
 
-        expected_normalized = [normalize_param(p) for p in expected_params]
-
-        actual_normalized = [normalize_param(p) for p in params]
+        yield trn_id, comparison
 
 
  
 
-        if expected_normalized == actual_normalized:
+def read_output_rows(path):
 
-            output_lines.append("  Parameters: Passed")
+    """Reads a query output file as a tuple of stripped lines, one per row."""
 
-            output_lines.append(f"  marks: {param_marks}")
+    with open(path, 'r') as f:
 
-            total_marks += param_marks
+        return tuple(line.strip() for line in f.readlines())
 
-        else:
 
-            output_lines.append("  Parameters: Failed")
+ 
 
-            output_lines.append(f"    Expected: {expected_normalized}")
 
-            output_lines.append(f"    Actual:   {actual_normalized}")
+ 
 
+class ResultDigest:
 
- 
+    """Incremental result_digest, fed one output line at a time."""
 
-        expected_return_type = meta_data.get("return_type", "").lower()
+    def __init__(self):
 
-        return_type_marks = meta_data.get("return_type_marks", 0)
+        self.sha = hashlib.sha256()
+
+        self.count = 0
 
 
  
 
-        try:
+    def update(self, row):
 
-            cursor.execute(f"SHOW CREATE FUNCTION {routine_name}")
+        self.sha.update(row.encode("utf-8"))
 
-            create_stmt = cursor.fetchone()[2]  
+        self.sha.update(b"\n")
 
-            match = re.search(r"RETURNS\s+([a-zA-Z0-9\(\), ]+)", create_stmt, re.IGNORECASE)
+        self.count += 1
 
-            actual_return_type = match.group(1).strip().lower() if match else "unknown"
 
-        except Exception as e:
+ 
 
-            actual_return_type = f"error: {e}"
+    def digest(self):
+
+        return self.count, self.sha.hexdigest()
 
 
  
 
-        if expected_return_type == actual_return_type:
 
-            output_lines.append("  Return Type: Passed")
+ 
 
-            output_lines.append(f"  marks: {return_type_marks}")
+def result_digest(rows):
 
-            total_marks += return_type_marks
+    """Row count plus a SHA-256 over the rows in order, so equal outputs compare in one step."""
 
-        else:
+    digest = ResultDigest()
 
-            output_lines.append("  Return Type: Failed")
+    for row in rows:
 
-            output_lines.append(f"    Expected: {expected_return_type}")
+        digest.update(row)
 
-            output_lines.append(f"    Actual:   {actual_return_type}")
+    return digest.digest()
 
 
  
 
-        for idx, case in enumerate(test_cases, 1):
-
-            call = case['function_call']
-
-            expected = case.get("Expected")
 
-            try:
+ 
 
-                cursor.execute(call)
+def describe_preview(preview, count):
 
-                rows = cursor.fetchall()
+    """The first output lines kept for the log, noting how many more were streamed past."""
 
-                result = [str(row[0]) for row in rows]
+    if count > len(preview):
 
-                status = "Passed" if str(result) == expected else "Failed"
+        return f"{preview} ... and {count - len(preview)} more rows"
 
-            except Exception as e:
+    return f"{preview}"
 
-                result = f"Error: {e}"
 
-                status = "Failed"
+ 
 
 
  
 
-            marks_awarded = int(case["marks"]) if status == "Passed" else 0
+def build_author_output_index():
 
-            total_marks += marks_awarded
+    """
 
-            output_lines.append(f"\nTestcase {idx}:")
+    Loads every author query output once after execute_author_queries,
 
-            output_lines.append(f"  Status: {status}")
+    keeping its rows (for diffs) and digest (for pass checks) in memory.
 
-            output_lines.append(f"  marks: {marks_awarded}")
+    """
 
-            if status == "Failed":
+    index = {}
 
-                output_lines.append(f"    Function Call: {call}")
+    output_dir = f"{AUTHOR_PATH}/output"
 
-                output_lines.append(f"    Expected: {expected}")
+    for query_file in os.listdir(f"{AUTHOR_PATH}/queries"):
 
-                output_lines.append(f"    Actual:   {result}")
+        output_path = os.path.join(output_dir, query_file)
 
+        if query_file.endswith(".txt") and os.path.exists(output_path):
 
- 
+            rows = read_output_rows(output_path)
 
-        output_lines.append(f"\nTotal marks for functions: {total_marks}")
+            index[query_file] = {
 
-        return "\n".join(output_lines)
+                "rows": rows,
 
+                "digest": result_digest(rows)
 
- 
+            }
 
-    except Exception as e:
+    return index
 
-        return f"Error executing functions: {e}"
+
+ 
 
 
  
 
-def execute_author_queries(cursor):
+def execute_commands(file_path, cursor, log_file, is_author=False, output_path=None, trn_id=None, content=None, test_plan=None, outcome=None, state=None):
 
-    with open("logfile/execution.log", 'a') as log_file:
+    file_name = os.path.basename(file_path)
 
+    started = time.perf_counter()
 
- 
+    if test_plan is not None:
 
-        execute_commands(f'{AUTHOR_PATH}/sample_db.txt',cursor,log_file, is_author = True)
+        marks_dict = test_plan["marks"]
 
+    else:
 
- 
+        marks_dict = dict(dotenv_values(f"{AUTHOR_PATH}/.env"))
 
-        os.makedirs(f'{AUTHOR_PATH}/output', exist_ok=True)
+    author_path = f"{AUTHOR_PATH}/output/"
 
 
  
 
-        queries_dir = f'{AUTHOR_PATH}/queries'
+    routines = []
 
-        for query_file in os.listdir(queries_dir):
+    # The author's output is the expected result, so it is never cut short; a
 
-            if query_file.endswith(".txt"):
+    # trainee's is capped, but never below the author's row count for the file.
 
-                file_path = os.path.join(queries_dir,query_file)
+    limit = 0
 
-                output_path = os.path.join(f"{AUTHOR_PATH}/output", query_file)
+    if not is_author:
 
-                execute_commands(file_path, cursor,log_file,is_author=True, output_path=output_path)
+        author_output = test_plan["author_outputs"].get(file_name)
 
+        limit = trainee_row_limit(len(author_output["rows"]) if author_output else 0)
 
- 
+    # Result lines are hashed, previewed and written out as they are fetched,
 
-def execute_submissions(cursor):
+    # so memory stays bounded by FETCH_BATCH_SIZE however large the output is.
 
-   solutions_dir = "Solutions"
+    digest = ResultDigest()
 
-   os.makedirs(solutions_dir, exist_ok=True)
+    preview = []
 
 
  
 
-   log_dir = "logfile"
+    def emit(line):
 
-   os.makedirs(log_dir, exist_ok=True)
+        digest.update(line)
 
-   log_path = os.path.join(log_dir, "execution.log")
+        if len(preview) < RESULT_PREVIEW_ROWS:
 
+            preview.append(line)
 
- 
+        if output is not None:
 
-   with open(log_path, 'w') as log_file:
+            output.write(line + '\n')
 
-       for file in os.listdir(SUBMISSION_PATH):
 
-           if file.endswith(".zip"):
+ 
 
-               trn_id = os.path.splitext(file)[0]
+    def emit_rows(rows, captured=None):
 
+        for row in rows:
 
- 
+            line = str(row)
 
-               log_with_indent(log_file, f"{trn_id}:", 0)
+            emit(line)
 
+            if captured is not None and len(captured) <= RESULT_CACHE_ROWS:
 
- 
+                captured.append(line)
 
-               extract_path = os.path.join(SUBMISSION_PATH, f"unzipped_{trn_id}")
 
-               os.makedirs(extract_path, exist_ok=True)
+ 
 
+    # Execute: statements stream straight from the file unless the text was passed in.
 
- 
+    with (open(file_path, 'r') if content is None else nullcontext(content)) as source, (open(output_path, 'w') if output_path else nullcontext()) as output:
 
-               with zipfile.ZipFile(os.path.join(SUBMISSION_PATH, file), 'r') as zip_ref:
+        for command in split_sql_statements(source):
 
-                   zip_ref.extractall(extract_path)
+            # With the file's data state known, read-only statements are answered from the
 
+            # shared result cache; anything else moves the file on to a new state.
 
- 
+            read_only = state is not None and is_read_only(command)
 
-               mysql_path = os.path.join(extract_path, trn_id, "MySQL")
+            cache_key = RESULT_CACHE.key(state, command) if read_only else None
 
-               trn_solution_path = os.path.join(solutions_dir, trn_id)
+            if cache_key is not None:
 
-               os.makedirs(trn_solution_path, exist_ok=True)
+                cached = RESULT_CACHE.get(cache_key)
 
+                if cached is not None:
 
- 
+                    METRICS.count("result_cache_hits")
 
-               log_with_indent(log_file, "function:", 1)
+                    for line in cached:
 
-               try:
+                        emit(line)
 
-                   fun_log = run_trainee_functions(cursor, mysql_path, trn_id)
+                    continue
 
-                   log_with_indent(log_file, fun_log, 2)
+                METRICS.count("result_cache_misses")
 
-               except Exception as e:
+            captured = [] if cache_key is not None else None
 
-                   log_with_indent(log_file, f"Error: {e}", 2)
+            try:
 
+                execute_statement(cursor, command, fetch=False, consume=lambda rows: emit_rows(rows, captured), limit=limit)
 
- 
+                if cache_key is not None:
 
-               log_with_indent(log_file, "procedure:", 1)
+                    RESULT_CACHE.put(cache_key, captured)
 
-               try:
 
-                   proc_log = run_trainee_procedures(cursor, mysql_path, trn_id)
+ 
+
+                if command[:6].upper() == "CREATE":
 
-                   log_with_indent(log_file, proc_log, 2)
+                    routine_type, routine_name = get_routine_type_and_name(command)
 
-               except Exception as e:
+                    if routine_name:
 
-                   log_with_indent(log_file, f"Error: {e}", 2)
+                        routines.append((routine_type, routine_name))
 
 
  
 
-               for query_file in os.listdir(mysql_path):
+            except Exception as e:
 
-                    if query_file.endswith(".txt") and query_file not in ["fun.txt", "proc.txt"]:
+                # A statement stopped by its time budget leaves the data in an unknown state.
 
-                        file_path = os.path.join(mysql_path, query_file)
+                if isinstance(e, StatementTimeout):
 
-                        try:
+                    state = None
 
-                            log_file.write(f"{query_file}:\n")
+                emit(f"Error: {e}")
 
-                            log_file.flush()
+                log_file.write(f" Error: {e}\n")
 
-                            execute_commands(file_path, cursor, log_file, is_author=False, trn_id=trn_id)
+                log_file.flush()
 
-                        except Exception as e:
+            if state is not None and not read_only:
 
-                            print(e)
+                state = RESULT_CACHE.advance(state, command)
 
 
  
 
-               log_with_indent(log_file, "", 0)
+    # Routine parameters are only recorded for the author, once per file.
 
+    if is_author and routines:
 
+        param_output_file = os.path.join(author_path+file_name)+"params.txt"
 
+        try:
 
- 
+            metadata = load_routine_metadata(cursor)
 
-def compare_outputs():
+            for routine_type, routine_name in routines:
 
-    author_output = f"{AUTHOR_PATH}/output"
+                routine = metadata.get((routine_type, routine_name.lower()))
 
-    solution_dir = "Solutions"
+                write_parameters_to_file(routine_name, routine["parameters"] if routine else [], param_output_file)
 
-    result = {}
+        except Exception as e:
+
+            log_file.write(f"Error fetching parameters for {routines[-1][1]}: {e}\n")
 
 
  
 
-    author_files = set(os.listdir(author_output))
+    # Compare the whole file's output once against the author output index.
 
+    if not is_author:
 
- 
+        author_output = test_plan["author_outputs"].get(file_name)
 
-    for trn_id in os.listdir(solution_dir):
+        if author_output is None:
 
-       
+            check_path = os.path.join(author_path, file_name)
 
-        trn_path = os.path.join(solution_dir, trn_id)
+            log_file.write(f"check file not found: {check_path}\n")
 
-        comparison = {}
+        else:
 
+            # Digests decide pass/fail; the row lists are only printed on a mismatch.
 
- 
+            status = "Passed" if digest.digest() == author_output["digest"] else "Failed"
 
-        for query_file in os.listdir(trn_path):
+            log_file.write(f"   Status: {status}\n")
 
-            if query_file == "fun_output.json" or query_file == "proc_output.json":
+            log_file.write(f"    marks: {marks_dict[file_name] if status == "Passed" else 0}\n")
 
-                continue
+            if status == "Failed":
 
-            sub_file = os.path.join(trn_path, query_file)
+                log_file.write(f"    Expected: {list(author_output['rows'])}\n")
 
-            auth_file = os.path.join(author_output, query_file)
+                log_file.write(f"    Actual: {describe_preview(preview, digest.count)}\n")
 
+            marks_awarded = parse_marks(marks_dict[file_name]) if status == "Passed" else 0
 
- 
+            if outcome is not None:
 
-            with open(auth_file, 'r') as f1, open(sub_file, 'r') as f2:
+                outcome["scores"][file_name] = marks_awarded
 
-                is_same = f1.read().strip() == f2.read().strip()
+            record_test(
 
-                comparison[query_file] = int(is_same)
+                outcome, f"query:{file_name}", status, marks_awarded, started,
 
+                detail=None if status == "Passed" else f"Expected: {list(author_output['rows'])}, Actual: {describe_preview(preview, digest.count)}"
 
- 
+            )
 
-        result[trn_id] = comparison
+        log_file.flush()
 
 
  
 
-    return result
-
 
  
 
-def execute_commands(file_path, cursor, log_file, is_author=False, output_path=None, trn_id=None):
-
-    file_name = os.path.basename(file_path)
+def generate_structured_log(store_path=None):
 
-    marks_dict = dict(dotenv_values(f"{AUTHOR_PATH}/.env"))
+    """Appends a per-trainee summary of every failed test, read from the results store."""
 
-    with open(file_path, 'r') as file:
+    log_path = os.path.join("logfile", "execution.log")
 
-        content = file.read()
+    sections = (("function", "No function output found."), ("procedure", "No procedure output found."), ("query", None))
 
-        statements = sqlparse.split(content)
 
-        author_path = f"{AUTHOR_PATH}/output/"
+ 
 
-       
+    with closing(open_results_store(store_path)) as store, open(log_path, 'a') as log_file:
 
-        results = []
+        trainees = [row[0] for row in store.execute("SELECT trainee FROM trainee_results ORDER BY trainee")]
 
+        for trn_id in trainees:
 
- 
+            tests = store.execute(
 
-       
+                "SELECT test_id, status, error, detail FROM test_results WHERE trainee = ? ORDER BY rowid",
 
-        for statement in statements:
+                (trn_id,)
 
-            command = statement.strip()
+            ).fetchall()
 
-            if not command:
+            log_file.write(f"{trn_id}:\n")
 
-                continue
 
-            try:
+ 
 
-                cursor.execute(command)
+            for section, missing in sections:
 
-                if cursor.with_rows:
+                section_tests = [test for test in tests if test[0].split(":", 1)[0] == section]
 
-                    rows = cursor.fetchall()
+                if not section_tests:
 
-                    for row in rows:
+                    if missing:
 
-                        results.append(str(row))
+                        log_file.write(f"  {section}: {missing}\n")
 
+                    continue
 
- 
+                if section != "query" and all(status == "Passed" for _, status, _, _ in section_tests):
 
-                routine_type, routine_name = get_routine_type_and_name(content)
+                    log_file.write(f"  {section}: execute successfully\n")
 
-                if routine_type and routine_name:
+                    continue
 
-                    param_output_file = os.path.join(author_path+file_name)+"params.txt"
+                if section != "query":
 
-                    try:
+                    log_file.write(f"  {section}:\n")
 
-                        cursor.execute("SELECT DATABASE();")
+                for test_id, status, error, detail in section_tests:
 
-                        db_name = cursor.fetchone()[0]
+                    name = test_id.split(":", 1)[1]
 
-                        write_parameters_to_file(cursor, db_name, routine_name, param_output_file, is_author=True)
+                    if section == "query":
 
-                    except Exception as e:
+                        log_file.write(f"  {name}:\n")
 
-                        log_file.write(f"Error fetching parameters for {routine_name}: {e}\n")
+                        if status == "Passed":
 
+                            log_file.write("    execute successfully\n")
 
- 
+                    if status != "Passed":
 
-                if not is_author:
+                        log_file.write(f"    {name}: {error or detail or status}\n")
 
-                    check_path = os.path.join(author_path, file_name)
+            log_file.write("\n")
 
-                   
 
-                    try:
+ 
 
-                        with open(check_path, 'r') as f:
+           
 
-                            expected = [line.strip() for line in f.readlines()]
+def grade_one(cursor, trn_id):
 
-                            actual = [str(row) for row in results]
+    """
 
-                            status = "Passed" if actual == expected else "Failed"
+    Re-grades a single trainee on worker schema 0 and records the result in
 
-                            log_file.write(f"   Status: {status}\n")
+    the grading cache and the results store; nobody else's results change.
 
-                            log_file.write(f"    marks: {marks_dict[file_name] if status == "Passed" else 0}\n")
+    Run `report` afterwards to rebuild the scoreboard.
 
+    """
 
- 
+    zip_path = os.path.join(SUBMISSION_PATH, f"{trn_id}.zip")
 
-                     
+    if not os.path.exists(zip_path):
 
-                        if status == "Failed":
+        logging.error(f"Submission not found: {zip_path}")
 
-                            log_file.write(f"    Expected: {expected}\n")
+        print(f"Submission not found: {zip_path}")
 
-                            log_file.write(f"    Actual: {actual}\n")
+        return None
 
-                        log_file.flush()
+    test_plan = compile_test_plan()
 
-                   
+    ensure_fixture_schema(cursor)
 
-                    except FileNotFoundError as fe:
+    schema = worker_schema_name(0)
 
-                        log_file.write(f"check file not found: {check_path}, {fe}\n")
+    use_worker_schema(cursor, schema)
 
-                        log_file.flush()
+    try:
 
-           
+        reset_worker_schema(cursor, schema)
 
-            except Exception as e:
+        entry = grade_trainee(cursor, zip_path, trn_id, "Solutions", test_plan, schema=schema)
 
-                results.append(f"Error: {e}")
+        cursor.execute("COMMIT")
 
-                log_file.write(f" Error: {e}\n")
+    finally:
 
-                log_file.flush()
+        cursor.execute(f"USE `{DB_CONFIG['database']}`")
 
+    store_cached_grade(grading_cache_key(zip_path, trn_id, test_plan), entry)
 
- 
+    with closing(open_results_store()) as store:
 
-    if output_path:
+        save_trainee_results(store, entry)
 
-        with open(output_path, 'w') as f:
+    print(entry["log"])
 
-            for line in results:
+    return entry
 
-                f.write(line + '\n')
+ 
 
 
  
 
-def generate_structured_log():
-
-    log_path = os.path.join("logfile", "execution.log")
+def command_prepare_author(cursor, args):
 
-    solutions_dir = "Solutions"
+    started = time.perf_counter()
 
-    author_output_dir = f"{AUTHOR_PATH}/output"
+    prepare_author_artifacts(cursor)
 
+    METRICS.record_phase("author", started)
 
  
 
-    with open(log_path, 'a') as log_file:
 
-        for trn_id in os.listdir(solutions_dir):
+ 
 
-            trn_path = os.path.join(solutions_dir, trn_id)
+def command_grade(cursor, args):
 
-            log_file.write(f"{trn_id}:\n")
+    with open('logfile/execution.log', 'w') as f:
 
+        f.write("\n")
 
- 
+    started = time.perf_counter()
 
-            fun_file = os.path.join(trn_path, "fun_output.json")
+    test_plan = compile_test_plan()
 
-            if os.path.exists(fun_file):
+    METRICS.record_phase("test_plan", started)
 
-                with open(fun_file) as f:
+    started = time.perf_counter()
 
-                    fun_output = json.load(f)
+    execute_submissions(cursor, test_plan, workers=args.workers, decoders=args.decoders)
 
-                    passed_all = all(tc.get("Status") == "Passed" for tc in fun_output)
+    METRICS.record_phase("grading", started)
 
-                    if passed_all:
+ 
 
-                        log_file.write(f"  function: execute successfully\n")
 
-                    else:
+ 
 
-                        log_file.write("  function:\n")
+def command_run(cursor, args):
 
-                        for tc in fun_output:
+    command_prepare_author(cursor, args)
 
-                            if tc.get("Status") != "Passed":
+    command_grade(cursor, args)
 
-                                log_file.write(f"    call: {tc.get('function_call')}\n")
+ 
 
-                                log_file.write(f"      Expected: {tc.get('Excepted')}\n")
 
-                                log_file.write(f"      Actual:   {tc.get('Actual')}\n")
+ 
 
-            else:
+def command_grade_one(cursor, args):
 
-                log_file.write("  function: No function output found.\n")
+    grade_one(cursor, args.trn_id)
+
+ 
 
 
  
 
-            proc_file = os.path.join(trn_path, "proc_output.json")
+def command_report(args):
 
-            if os.path.exists(proc_file):
+    write_results_to_excel(args.output)
 
-                with open(proc_file) as f:
+    generate_structured_log()
 
-                    proc_output = json.load(f)
 
-                    passed_all = all(p.get("Status") == "Passed" for p in proc_output)
 
-                    if passed_all:
+def command_bench_splitter(args):
 
-                        log_file.write(f"  procedure: execute successfully\n")
+    benchmark_sql_splitter(args.path, repeat=args.repeat)
 
-                    else:
+ 
 
-                        log_file.write("  procedure:\n")
 
-                        for p in proc_output:
+ 
 
-                            if p.get("Status") != "Passed":
+# Commands that need a database connection.
 
-                                log_file.write(f"    procedure_call: {p.get('procedure_call')}\n")
+COMMANDS = {
 
-                                log_file.write(f"      Expected: {p.get('Expected')}\n")
+    "run": command_run,
 
-                                log_file.write(f"      Actual:   {p.get('Actual')}\n")
+    "prepare-author": command_prepare_author,
 
-                                for chk in p.get("checks", []):
+    "grade": command_grade,
 
-                                    if chk.get("Status") != "Passed":
+    "grade-one": command_grade_one
 
-                                        log_file.write(f"      Check Query: {chk.get('query')}\n")
+}
 
-                                        log_file.write(f"        Expected: {chk.get('Expected')}\n")
+ 
 
-                                        log_file.write(f"        Actual:   {chk.get('Actual')}\n")
 
-            else:
+ 
 
-                log_file.write("  procedure: No procedure output found.\n")
+def build_parser():
 
+    parser = argparse.ArgumentParser(
 
- 
+        prog="Evalutor.py",
 
-            for query_file in os.listdir(trn_path):
+        description="Grades trainee MySQL submissions against the author's solutions."
 
-                if query_file.endswith(".txt"):
+    )
 
-                    trainee_file = os.path.join(trn_path, query_file)
+    parser.add_argument("--host", default=DB_CONFIG["host"], help="MySQL host (MYSQL_HOST)")
 
-                    author_file = os.path.join(author_output_dir, query_file)
+    parser.add_argument("--port", type=int, default=DB_CONFIG["port"], help="MySQL port (MYSQL_PORT)")
 
+    parser.add_argument("--user", default=DB_CONFIG["user"], help="MySQL user (MYSQL_USER)")
 
- 
+    parser.add_argument("--password", default=DB_CONFIG["password"], help="MySQL password; prefer MYSQL_PASSWORD")
 
-                    log_file.write(f"  {query_file}:\n")
+    parser.add_argument("--database", default=DB_CONFIG["database"], help="Author database (MYSQL_DATABASE)")
 
-                    if os.path.exists(author_file):
+    parser.add_argument("--author-path", default=AUTHOR_PATH, help="Author folder (AUTHOR_PATH)")
 
-                        with open(trainee_file, 'r') as f1, open(author_file, 'r') as f2:
+    parser.add_argument("--submission-path", default=SUBMISSION_PATH, help="Folder of trainee zips (SUBMISSION_PATH)")
 
-                            trainee_output = f1.read().strip()
+    parser.add_argument("--workers", type=int, default=GRADING_WORKERS, help="Trainees graded at once (GRADING_WORKERS)")
 
-                            author_output = f2.read().strip()
+    parser.add_argument("--decoders", type=int, default=DECODE_WORKERS, help="Threads decoding zips (DECODE_WORKERS)")
 
-                            if trainee_output == author_output:
+    commands = parser.add_subparsers(dest="command", metavar="command")
 
-                                log_file.write("    execute successfully\n")
+    commands.add_parser("run", help="prepare the author artifacts, then grade every submission (default)")
 
-                            else:
+    commands.add_parser("prepare-author", help="refresh the author test plan and expected outputs")
 
-                                log_file.write("    Expected:\n")
+    commands.add_parser("grade", help="grade every submission against the prepared author artifacts")
 
-                                log_file.write(f"{author_output}\n")
+    grade_one_parser = commands.add_parser("grade-one", help="re-grade one trainee and update the results store")
 
-                                log_file.write("    Actual:\n")
+    grade_one_parser.add_argument("trn_id")
 
-                                log_file.write(f"{trainee_output}\n")
+    report_parser = commands.add_parser("report", help="rebuild the scoreboard and failure summary from the results store")
 
-                    else:
+    report_parser.add_argument("--output", default=f"{SCOREBOARD_PATH}.xlsx", help="scoreboard file; CSV/Parquet go next to it")
 
-                        log_file.write("    Author output not found for comparison.\n")
+    bench_parser = commands.add_parser("bench-splitter", help="time the SQL statement splitter against sqlparse on one file")
 
-            log_file.write("\n")
+    bench_parser.add_argument("path")
 
+    bench_parser.add_argument("--repeat", type=int, default=3, help="runs per splitter; the best is reported")
+
+    return parser
 
  
 
-           
 
-def main():
+ 
+
+def run_with_connection(action, args):
 
     con = None
 
@@ -1643,11 +6623,7 @@ def main():
 
     try:
 
-        con = mysql.connector.connect(
-
-            host="localhost", user="root", password="root", database="emp"
-
-        )
+        con = mysql.connector.connect(**DB_CONFIG)
 
         if con.is_connected():
 
@@ -1655,50 +6631,67 @@ def main():
 
             cur = con.cursor()
 
-           
+            action(cur, args)
 
-            with open('logfile/execution.log', 'w') as f:
+    except mysql.connector.Error as e:
 
-                f.write("\n")
+        logging.error(f"MySQL Error: {e}")
 
-            write_to_json()
+        print(e)
 
-            execute_author_queries(cur)
+    finally:
 
-            generate_expected_output(cur)
+        if con and cur:
 
-            generate_procedure_test(cur)
+            con.commit()
 
-            execute_submissions(cur)
+            cur.close()
 
+            con.close()
 
- 
+            logging.info("Database connection closed.")
 
-    except mysql.connector.Error as e:
+        METRICS.write_report()
 
-        logging.error(f"MySQL Error: {e}")
+        TRACER.write()
 
-        print(e)
+ 
 
 
  
 
-    finally:
+def main(argv=None):
 
-        if con and cur:
+    global AUTHOR_PATH, SUBMISSION_PATH
 
-            con.commit()
+    args = build_parser().parse_args(argv)
 
-            cur.close()
+    DB_CONFIG.update(host=args.host, port=args.port, user=args.user, password=args.password, database=args.database)
 
-            con.close()
+    AUTHOR_PATH = args.author_path
 
-            logging.info("Database connection closed.")
+    SUBMISSION_PATH = args.submission_path
+
+    command = args.command or "run"
+
+    if command == "report":
 
+        command_report(args)
+
+        return
+
+    if command == "bench-splitter":
+
+        command_bench_splitter(args)
+
+        return
+
+    run_with_connection(COMMANDS[command], args)
 
  
 
-   
+
+ 
 
 if __name__ == '__main__':
 
@@ -0,0 +1,112 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("AUTHOR_PATH", os.path.dirname(__file__))
+os.environ.setdefault("SUBMISSION_PATH", os.path.dirname(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Evalutor  # noqa: E402
+
+sqlparse = pytest.importorskip("sqlparse")
+
+
+def split(sql):
+    return list(Evalutor.split_sql_statements(sql))
+
+
+def reference(sql):
+    """sqlparse.split without the trailing delimiter, like split_sql_statements."""
+    return [s.strip().rstrip(";").strip() for s in sqlparse.split(sql) if s.strip()]
+
+
+ROUTINE_BODIES = [
+    """CREATE FUNCTION bonus(salary DECIMAL(10,2)) RETURNS DECIMAL(10,2) DETERMINISTIC
+BEGIN
+    DECLARE rate DECIMAL(4,2);
+    SET rate = IF(salary > 5000, 0.10, 0.05);
+    RETURN salary * rate;
+END;
+SELECT bonus(1000);""",
+    """CREATE PROCEDURE raise_all(IN pct INT)
+BEGIN
+    IF (pct > 0) THEN
+        UPDATE employees SET salary = salary * (1 + pct / 100);
+    ELSE
+        SELECT 'nothing to do;';
+    END IF;
+    WHILE pct > 0 DO
+        SET pct = pct - 1;
+    END WHILE;
+    SELECT CASE WHEN pct = 0 THEN 'done' ELSE 'left' END;
+END;
+CALL raise_all(5);""",
+    """CREATE TRIGGER no_negative BEFORE INSERT ON employees FOR EACH ROW
+BEGIN
+    IF NEW.salary < 0 THEN
+        SET NEW.salary = 0;
+    END IF;
+END;
+INSERT INTO employees (salary) VALUES (-1);""",
+    """CREATE TRIGGER stamp BEFORE INSERT ON employees FOR EACH ROW SET NEW.hired = NOW();
+INSERT INTO employees (salary) VALUES (1);""",
+]
+
+
+QUOTED = [
+    """SELECT 'a;b', "c;d", `e;f` FROM t; SELECT 'it''s; fine';""",
+    """INSERT INTO t VALUES ('BEGIN'), ("END;"); SELECT 1;""",
+]
+
+
+@pytest.mark.parametrize("sql", ROUTINE_BODIES + QUOTED)
+def test_matches_sqlparse(sql):
+    assert split(sql) == reference(sql)
+
+
+def test_nested_blocks_stay_together():
+    sql = """CREATE PROCEDURE p()
+BEGIN
+    outer_loop: LOOP
+        REPEAT
+            SET @x = REPEAT('a', 2);
+        UNTIL 1 END REPEAT;
+        CASE @x
+            WHEN 'aa' THEN LEAVE outer_loop;
+            ELSE BEGIN DROP TABLE IF EXISTS tmp; END;
+        END CASE;
+    END LOOP outer_loop;
+END;
+SELECT 1;"""
+    statements = split(sql)
+    assert len(statements) == 2
+    assert statements[0].endswith("END")
+    assert statements[1] == "SELECT 1"
+
+
+def test_comments():
+    sql = """-- leading; comment
+SELECT 1; # trailing; comment
+/* block; comment */ SELECT 2 /* ; inline */;
+CREATE PROCEDURE p()
+BEGIN
+    -- END;
+    SELECT 3; /* END; */
+END;"""
+    assert split(sql) == [
+        "SELECT 1",
+        "SELECT 2 /* ; inline */",
+        "CREATE PROCEDURE p()\nBEGIN\n    -- END;\n    SELECT 3; /* END; */\nEND",
+    ]
+
+
+def test_delimiter_blocks_unchanged():
+    sql = """DELIMITER $$
+CREATE FUNCTION f() RETURNS INT
+BEGIN
+    RETURN 1;
+END$$
+DELIMITER ;
+SELECT f();"""
+    assert split(sql) == ["CREATE FUNCTION f() RETURNS INT\nBEGIN\n    RETURN 1;\nEND", "SELECT f()"]